@@ -5,3 +5,6 @@ host = "127.0.0.1"
 port = 3553
 pulse_api_url = f"http://{host}:{port}/prompts"
 pulse_user_api_url = f"{pulse_api_url}/users/"
+pulse_stats_api_url = f"{pulse_api_url}/stats"
+pulse_jobs_url = f"http://{host}:{port}/jobs/"
+page_size = 200
@@ -0,0 +1,160 @@
+"""
+Rewrites the large columns of an existing database as the API is
+configured to store them, or trains a dictionary to compress them against
+
+    python -m api.compact [--batch-size 1000]
+    python -m api.compact train --output pulse.dict [--samples 10000] [--size 32768]
+
+With PULSE_COMPRESSION set, values are compressed with the configured
+level and dictionary; without it they are decompressed. Rows compressed
+with an older dictionary are read with any of PULSE_COMPRESSION_DICTIONARY
+after the first. Run it with the API stopped.
+"""
+import argparse
+import collections
+import json
+
+from sqlalchemy import LargeBinary, bindparam, inspect, select, text, type_coerce
+
+from api.compression import Codec, Compressed, build_dictionary, dictionary_size, is_json
+
+
+def large_columns(pulse_fastapi):
+    """
+    :return: the tables with large columns, with their keys and large columns
+    """
+    prompts = pulse_fastapi.PromptModel.__table__
+    payloads = pulse_fastapi.PayloadModel.__table__
+    return [
+        (prompts, prompts.c.prompt_id, [prompts.c[field] for field in pulse_fastapi.payload_fields]),
+        (payloads, payloads.c.digest, [payloads.c.content])
+    ]
+
+
+def rewrite(engine, table, key, columns, read_codec, write_types, batch_size):
+    """
+    Rewrites columns of every row of table, in batches ordered by key
+
+    :param write_types: the type each column is written with, by name
+    """
+    reads = [
+        type_coerce(column, Compressed(read_codec, as_json=is_json(column.type), lazy=False)).label(column.name)
+        for column in columns
+    ]
+    statement = table.update().where(key == bindparam("row_key")).values(
+        {column.name: bindparam(f"new_{column.name}", type_=write_types[column.name]) for column in columns}
+    )
+    last = None
+    rewritten = 0
+    while True:
+        query = select(key.label("row_key"), *reads).order_by(key).limit(batch_size)
+        if last is not None:
+            query = query.where(key > last)
+        with engine.begin() as connection:
+            rows = connection.execute(query).all()
+            if not rows:
+                return rewritten
+            connection.execute(statement, [
+                {"row_key": row.row_key, **{f"new_{column.name}": row._mapping[column.name] for column in columns}}
+                for row in rows
+            ])
+        last = rows[-1].row_key
+        rewritten += len(rows)
+
+
+def compact(pulse_fastapi, batch_size):
+    engine = pulse_fastapi.engine
+    if engine.dialect.name not in ("sqlite", "postgresql"):
+        raise ValueError(f"Compacting {engine.dialect.name} databases is not supported")
+    read_codec = Codec(dictionaries=pulse_fastapi.compression_dictionaries)
+    for table, key, columns in large_columns(pulse_fastapi):
+        write_types = {column.name: column.type for column in columns}
+        if engine.dialect.name == "postgresql":
+            # Binary values cannot be stored in text columns, so the columns change type around the rewrite
+            binary = {
+                column["name"] for column in inspect(engine).get_columns(table.name)
+                if isinstance(column["type"], LargeBinary)
+            }
+            if pulse_fastapi.compress_columns:
+                with engine.begin() as connection:
+                    for column in columns:
+                        if column.name not in binary:
+                            connection.execute(text(
+                                f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                                f"TYPE BYTEA USING convert_to({column.name}::text, 'UTF8')"
+                            ))
+            else:
+                columns = [column for column in columns if column.name in binary]
+                write_types = {
+                    column.name: Compressed(Codec(level=0), as_json=is_json(column.type)) for column in columns
+                }
+        if columns:
+            count = rewrite(engine, table, key, columns, read_codec, write_types, batch_size)
+            print(f"Rewrote {', '.join(column.name for column in columns)} of {count} {table.name}")
+        if engine.dialect.name == "postgresql" and not pulse_fastapi.compress_columns:
+            with engine.begin() as connection:
+                for column in columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                        f"TYPE {column_type} USING convert_from({column.name}, 'UTF8')::{column_type}"
+                    ))
+    if engine.dialect.name == "sqlite":
+        # Returns the pages freed by compression to the file system
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+
+
+def train(pulse_fastapi, samples, size):
+    """
+    Builds a dictionary from the most referenced payloads and the most
+    recent values stored in the prompts themselves
+    """
+    engine = pulse_fastapi.engine
+    read_codec = Codec(dictionaries=pulse_fastapi.compression_dictionaries)
+    counts = collections.Counter()
+    payloads = pulse_fastapi.PayloadModel.__table__
+    for table, key, columns in large_columns(pulse_fastapi):
+        reads = [
+            type_coerce(column, Compressed(read_codec, as_json=is_json(column.type), lazy=False))
+            for column in columns
+        ]
+        query = select(*reads, payloads.c.refs if table is payloads else key)
+        query = query.order_by(payloads.c.refs.desc() if table is payloads else key.desc()).limit(samples)
+        with engine.connect() as connection:
+            for *values, weight in connection.execute(query):
+                for value in values:
+                    if value in (None, ""):
+                        continue
+                    sample = (value if isinstance(value, str) else json.dumps(value)).encode("utf-8")
+                    counts[sample] += weight if table is payloads else 1
+    return build_dictionary(counts, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m api.compact", description="Compact the Pulse database")
+    subparsers = parser.add_subparsers(dest="command")
+    train_parser = subparsers.add_parser("train", help="train a compression dictionary")
+    train_parser.add_argument("--output", required=True)
+    train_parser.add_argument("--samples", type=int, default=10000, help="rows sampled from each table (default 10000)")
+    train_parser.add_argument("--size", type=int, default=dictionary_size)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from api import pulse_fastapi
+
+    try:
+        if args.command == "train":
+            dictionary = train(pulse_fastapi, args.samples, args.size)
+            with open(args.output, "wb") as dictionary_file:
+                dictionary_file.write(dictionary)
+            print(f"Saved a {len(dictionary)} byte dictionary to {args.output}")
+        else:
+            compact(pulse_fastapi, args.batch_size)
+    finally:
+        pulse_fastapi.writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
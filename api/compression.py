@@ -0,0 +1,163 @@
+"""
+Transparent compression of large text and JSON columns
+"""
+import json
+import zlib
+
+from sqlalchemy import JSON, LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+# Compressed values are framed as MAGIC, a kind and the data. Values stored
+# before compression was enabled, or by a level 0 codec, have no frame.
+MAGIC = b"\x00"
+RAW = b"r"
+ZLIB = b"z"
+ZLIB_DICTIONARY = b"d"
+
+# The most of a preset dictionary zlib can make use of
+dictionary_size = 32768
+
+
+def dictionary_id(dictionary):
+    return zlib.crc32(dictionary).to_bytes(4, "big")
+
+
+def build_dictionary(samples, size=dictionary_size):
+    """
+    Builds a zlib preset dictionary from the most common samples, with
+    the most common last, where matches against it are cheapest to encode
+
+    :param samples: a mapping of samples, as bytes, to how often they occur
+    """
+    chosen = []
+    total = 0
+    for sample, _ in sorted(samples.items(), key=lambda item: item[1], reverse=True):
+        if total + len(sample) <= size:
+            chosen.append(sample)
+            total += len(sample)
+    return b"".join(reversed(chosen))
+
+
+class Codec:
+    """
+    Compresses values with zlib, optionally against a trained dictionary
+
+    Values are compressed with the first of dictionaries, and may be
+    decompressed with any of them, so older values stay readable when a
+    new dictionary is trained. Values shorter than min_size, or which do
+    not shrink, are stored as they are.
+
+    :param level: the zlib compression level, where 0 stores values unframed
+    """
+
+    def __init__(self, level=6, dictionaries=(), min_size=64):
+        self.level = level
+        self.min_size = min_size
+        self.dictionary = dictionaries[0] if dictionaries else None
+        self.dictionaries = {dictionary_id(dictionary): dictionary for dictionary in dictionaries}
+
+    def compress(self, data):
+        if self.level == 0:
+            return data
+        if len(data) < self.min_size:
+            return MAGIC + RAW + data
+        if self.dictionary is None:
+            frame = MAGIC + ZLIB + zlib.compress(data, self.level)
+        else:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+            frame = MAGIC + ZLIB_DICTIONARY + dictionary_id(self.dictionary) + compressor.compress(data) + compressor.flush()
+        return frame if len(frame) < len(data) + 2 else MAGIC + RAW + data
+
+    def decompress(self, frame):
+        if not frame.startswith(MAGIC):
+            return frame
+        kind = frame[1:2]
+        if kind == RAW:
+            return frame[2:]
+        if kind == ZLIB:
+            return zlib.decompress(frame[2:])
+        if kind == ZLIB_DICTIONARY:
+            dictionary = self.dictionaries.get(frame[2:6])
+            if dictionary is None:
+                raise ValueError("Value was compressed with a dictionary which is not configured")
+            decompressor = zlib.decompressobj(zdict=dictionary)
+            return decompressor.decompress(frame[6:]) + decompressor.flush()
+        raise ValueError(f"Unknown compressed value kind {kind!r}")
+
+
+class CompressedValue:
+    """
+    A value read from a lazy compressed column
+
+    Only the compressed form is held; it is decompressed each time it is read.
+    """
+
+    __slots__ = ("frame", "type")
+
+    def __init__(self, frame, type_):
+        self.frame = frame
+        self.type = type_
+
+    def decode(self):
+        return self.type.decode(self.frame)
+
+
+def decompressed(value):
+    """
+    :return: value, decompressed if it was read from a lazy compressed column
+    """
+    return value.decode() if isinstance(value, CompressedValue) else value
+
+
+class Compressed(TypeDecorator):
+    """
+    A text or JSON column stored compressed as binary
+
+    Text read back from before the column was compressed is returned as it is.
+
+    :param as_json: whether values are serialised to JSON, as with the JSON type
+    :param lazy: whether values are read as CompressedValue, to be decompressed on access
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, codec, as_json=False, lazy=True):
+        super().__init__()
+        self.codec = codec
+        self.as_json = as_json
+        self.lazy = lazy
+
+    def decode(self, frame):
+        text = self.codec.decompress(frame).decode("utf-8")
+        return json.loads(text) if self.as_json else text
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, CompressedValue):
+            return value.frame
+        if self.as_json:
+            value = json.dumps(value)
+        elif value is None:
+            return None
+        return self.codec.compress(value.encode("utf-8"))
+
+    def result_processor(self, dialect, coltype):
+        # Bypasses the binary result processor, which cannot read text stored before compression
+        def process(value):
+            return self.process_result_value(value, dialect)
+        return process
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return json.loads(value) if self.as_json else value
+        value = bytes(value)
+        return CompressedValue(value, self) if self.lazy else self.decode(value)
+
+
+def is_json(column_type):
+    """
+    :return: whether a column, compressed or not, holds JSON
+    """
+    return column_type.as_json if isinstance(column_type, Compressed) else isinstance(column_type, JSON)
@@ -0,0 +1,106 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import threading
+import uuid
+
+
+class Job:
+    """
+    A unit of work submitted to a JobQueue, which can be polled
+    or waited on until its result is ready
+    """
+
+    def __init__(self, **info):
+        self.job_id = uuid.uuid4().hex
+        self.created = datetime.datetime.now()
+        self.info = info
+        self.future = None
+        self.started = False
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "running" if self.started else "queued"
+        return "failed" if self.future.exception() else "complete"
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job has finished or the timeout has elapsed
+        """
+        concurrent.futures.wait([self.future], timeout=timeout)
+        return self.future.done()
+
+    async def async_wait(self, timeout=None):
+        """
+        Waits on the event loop until the job has finished or the timeout has elapsed
+        """
+        future = self.future if isinstance(self.future, asyncio.Future) else asyncio.wrap_future(self.future)
+        await asyncio.wait([future], timeout=timeout)
+        return self.future.done()
+
+    def dict(self):
+        output = {"job_id": self.job_id, "status": self.status, "created": self.created, **self.info}
+        if self.status == "complete":
+            output["result"] = self.future.result()
+        elif self.status == "failed":
+            output["error"] = str(self.future.exception())
+        return output
+
+
+class JobQueue:
+    """
+    Runs jobs on a pool of worker threads, or as tasks on the event loop
+    for coroutine functions, and keeps the most recent of them so
+    callers can collect their results
+    """
+
+    def __init__(self, workers, max_tasks=1000, retention=10000):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pulse-job")
+        self.task_slots = asyncio.Semaphore(max_tasks)
+        self.retention = retention
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **info):
+        """
+        Queues fn(*args) to run on a worker, or if fn is a coroutine
+        function, to be awaited on the running event loop with at most
+        max_tasks running at once
+
+        :param info: extra fields reported alongside the job's status
+        :return: the queued Job
+        """
+        job = Job(**info)
+
+        if asyncio.iscoroutinefunction(fn):
+            async def run_task():
+                async with self.task_slots:
+                    job.started = True
+                    return await fn(*args)
+
+            job.future = asyncio.get_running_loop().create_task(run_task())
+        else:
+            def run():
+                job.started = True
+                return fn(*args)
+
+            job.future = self.executor.submit(run)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        # Drop the oldest finished jobs once more than `retention` are held
+        excess = len(self._jobs) - self.retention
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].future.done():
+                del self._jobs[job_id]
+                excess -= 1
@@ -0,0 +1,78 @@
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets: doubling from 0.1ms to about 52s
+latency_buckets = tuple(0.0001 * 2 ** i for i in range(20))
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in fixed, exponentially sized buckets, so
+    any number of observations can be recorded in constant memory
+    """
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        The upper bound of the bucket containing the q-th quantile
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def dict(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "max": self.max if self.count else None,
+                "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "buckets": [
+                    {"le": bound, "count": count}
+                    for bound, count in zip(self.buckets + ("+Inf",), self.counts) if count
+                ]
+            }
+
+
+class LatencyHistograms:
+    """
+    A LatencyHistogram per named stage, created on first use
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        if seconds is None:
+            return
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, LatencyHistogram())
+        histogram.record(seconds)
+
+    def dict(self):
+        return {name: histogram.dict() for name, histogram in list(self._histograms.items())}
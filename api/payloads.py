@@ -0,0 +1,130 @@
+import collections
+import hashlib
+import json
+import threading
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+# The dialects whose upserts payloads are stored with
+upsert_dialects = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class MissingPayload(LookupError):
+    """
+    Raised when a row refers to a payload which is not stored
+    """
+
+    def __init__(self, digest):
+        super().__init__(f"No payload is stored under digest {digest}")
+        self.digest = digest
+
+
+def encode_payload(value):
+    """
+    The canonical JSON of a value and the digest it is stored under
+    """
+    content = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest(), content
+
+
+class PayloadStore:
+    """
+    Content-addressed storage of the large values of stored prompts
+
+    Each distinct value is stored once, under the sha256 of its canonical
+    JSON, with a count of the rows which refer to it; rows hold its
+    digest in its place. Values are decoded through an LRU cache, since
+    the same handful of parameter profiles and repeated texts are read
+    over and over.
+
+    :param table: the payload table, with digest, content and refs columns
+    :param cache_size: the number of decoded values kept in memory
+    """
+
+    def __init__(self, engine, table, cache_size=65536):
+        self.engine = engine
+        self.table = table
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, digest, value):
+        """
+        Caches a value about to be stored, so it is not read back
+        """
+        with self._lock:
+            self._cache[digest] = value
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def add(self, connection, payloads):
+        """
+        Stores payloads within a transaction, counting one more reference
+        to each value for every time it appears
+
+        :param payloads: (digest, content) pairs
+        """
+        refs = collections.Counter()
+        contents = {}
+        for digest, content in payloads:
+            refs[digest] += 1
+            contents[digest] = content
+        if not refs:
+            return
+        insert = upsert_dialects[self.engine.dialect.name](self.table)
+        connection.execute(
+            insert.on_conflict_do_update(
+                index_elements=[self.table.c.digest], set_={"refs": self.table.c.refs + insert.excluded.refs}
+            ),
+            [{"digest": digest, "content": contents[digest], "refs": count} for digest, count in refs.items()]
+        )
+
+    def release(self, connection, digests):
+        """
+        Drops a reference to each of digests within a transaction, deleting
+        the values nothing refers to any more
+        """
+        digests = [digest for digest in digests if digest is not None]
+        if not digests:
+            return
+        for digest, count in collections.Counter(digests).items():
+            connection.execute(
+                update(self.table).where(self.table.c.digest == digest).values(refs=self.table.c.refs - count)
+            )
+        connection.execute(delete(self.table).where(self.table.c.digest.in_(digests), self.table.c.refs <= 0))
+        with self._lock:
+            for digest in digests:
+                self._cache.pop(digest, None)
+
+    def prefetch(self, digests):
+        """
+        Loads whichever of digests are not cached in one query
+        """
+        with self._lock:
+            missing = {digest for digest in digests if digest is not None and digest not in self._cache}
+        missing = list(missing)
+        # Stay well under the bound parameter limit of SQLite
+        for start in range(0, len(missing), 500):
+            query = select(self.table.c.digest, self.table.c.content).where(
+                self.table.c.digest.in_(missing[start:start + 500])
+            )
+            with self.engine.connect() as connection:
+                for digest, content in connection.execute(query):
+                    self.remember(digest, json.loads(content))
+
+    def get(self, digest):
+        """
+        :return: the value stored under digest
+        :raises MissingPayload: if nothing is stored under digest
+        """
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+        self.prefetch([digest])
+        with self._lock:
+            if digest not in self._cache:
+                raise MissingPayload(digest)
+            return self._cache[digest]
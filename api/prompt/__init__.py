@@ -1,3 +1,5 @@
 from ._data import *
 from .prompt import Prompt
-from .staging import Staging, BasicStaging
+from .profiles import ParameterProfile, profile
+from .costs import CostLedger, BudgetExceeded, UnknownModel, model_rates
+from .staging import Staging, BasicStaging, AsyncStaging, AsyncBasicStaging, ResponseCache, Blocklist, OpenAIClient, MockClient, UpstreamScheduler
@@ -1,4 +1,4 @@
-from ._api_rates import gpt_35_turbo, gpt_4_8k, gpt_4_32k, per
+from ._api_rates import gpt_35_turbo, gpt_4_8k, gpt_4_32k, text_davinci, text_davinci_002, text_curie, text_babbage, text_ada, per, api_rates, default_rate_limits
 from ._blocklist import blocklist
 from ._models import chat_completion_models, completion_models
 from ._params import completion_default_params, chat_completion_default_params
@@ -1,20 +1,76 @@
-
 per = 1000
 
+# prompt and completion are the price per `per` tokens; rpm and tpm are the
+# requests and tokens per minute the API allows for the model
 gpt_35_turbo = {
     "name": "gpt-3.5-turbo",
     "prompt": .002,
-    "completion": .002
+    "completion": .002,
+    "rpm": 3500,
+    "tpm": 90000
 }
 
 gpt_4_8k = {
     "name": "gpt-4",
     "prompt": .03,
-    "completion": .06
+    "completion": .06,
+    "rpm": 200,
+    "tpm": 40000
 }
 
 gpt_4_32k = {
     "name": "gpt-4-32k",
     "prompt": .06,
-    "completion": .12
+    "completion": .12,
+    "rpm": 200,
+    "tpm": 80000
+}
+
+text_davinci = {
+    "name": "text-davinci-003",
+    "prompt": .02,
+    "completion": .02,
+    "rpm": 3500,
+    "tpm": 350000
+}
+
+text_davinci_002 = {
+    "name": "text-davinci-002",
+    "prompt": .02,
+    "completion": .02,
+    "rpm": 3500,
+    "tpm": 350000
+}
+
+text_curie = {
+    "name": "text-curie-001",
+    "prompt": .002,
+    "completion": .002,
+    "rpm": 3500,
+    "tpm": 350000
 }
+
+text_babbage = {
+    "name": "text-babbage-001",
+    "prompt": .0005,
+    "completion": .0005,
+    "rpm": 3500,
+    "tpm": 350000
+}
+
+text_ada = {
+    "name": "text-ada-001",
+    "prompt": .0004,
+    "completion": .0004,
+    "rpm": 3500,
+    "tpm": 350000
+}
+
+# The rates of each model, by name
+api_rates = {
+    rates["name"]: rates
+    for rates in (gpt_35_turbo, gpt_4_8k, gpt_4_32k, text_davinci, text_davinci_002, text_curie, text_babbage, text_ada)
+}
+
+# The limits assumed for models missing from api_rates
+default_rate_limits = {"rpm": 3000, "tpm": 250000}
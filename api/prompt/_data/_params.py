@@ -1,5 +1,7 @@
+from ..profiles import profile
 
-completion_default_params = {
+
+completion_default_params = profile({
     "model": "text-davinci-003",
     "suffix": "[/]",
     "max_tokens":  64,
@@ -15,9 +17,9 @@ completion_default_params = {
     "best_of": 1,
     "logit_bias": {},
     "user": "Debug"
-}
+})
 
-chat_completion_default_params = {
+chat_completion_default_params = profile({
     "model": "gpt-3.5-turbo",
     "messages": [
         {"role": "system", "content": "You are ChatGPT, an AI language model developed by OpenAI."},
@@ -32,4 +34,4 @@ chat_completion_default_params = {
     "frequency_penalty": 0,
     "logit_bias": {},
     "user": "Debug"
-}
\ No newline at end of file
+})
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Model-aware cost accounting
+"""
+import collections
+import datetime
+import functools
+import re
+import threading
+
+from ._data import api_rates, per
+
+
+def lookup_rates(rates, model):
+    """
+    The rates of a model in a table of rates, matching dated snapshots
+    such as gpt-4-0613 to the model they are a snapshot of
+
+    :return: the model's rates, or None if it has none
+    """
+    if model in rates:
+        return rates[model]
+    snapshot = re.fullmatch(r"(.+)-\d{4}", model or "")
+    if snapshot and snapshot.group(1) in rates:
+        return rates[snapshot.group(1)]
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def model_rates(model):
+    """
+    The rates of a model in the API rates
+
+    :raises UnknownModel: if the model has no rates
+    """
+    rates = lookup_rates(api_rates, model)
+    if rates is None:
+        raise UnknownModel(f"No rates are known for model {model}")
+    return rates
+
+
+def cost(rates, prompt_tokens, completion_tokens):
+    """
+    :return: the cost, in dollars, of a request at rates
+    """
+    return (rates["prompt"] * prompt_tokens + rates["completion"] * completion_tokens) / per
+
+
+class UnknownModel(ValueError):
+    pass
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class CostLedger:
+    """
+    Running totals of the cost of stored prompts per day, and per user
+    and model within each day, and the daily budgets they are held to
+
+    A prompt reserves its estimated cost against today's budgets before
+    it is staged, so prompts still in flight count against them. The
+    reservation is settled with the actual cost once the prompt is
+    stored, or released if staging fails. Totals are kept as prompts are
+    reserved, stored and deleted, so checking a prompt against its
+    budgets is a few dictionary lookups however much history there is.
+
+    :param user_budget: the most each user may spend in a day, in dollars
+    :param model_budget: the most which may be spent on each model in a day
+    :param daily_budget: the most which may be spent in total in a day
+    """
+
+    def __init__(self, rows=(), user_budget=None, model_budget=None, daily_budget=None):
+        self.user_budget = user_budget
+        self.model_budget = model_budget
+        self.daily_budget = daily_budget
+        self._days = collections.defaultdict(lambda: {
+            "total": 0.0,
+            "reserved": 0.0,
+            "users": collections.defaultdict(float),
+            "models": collections.defaultdict(float)
+        })
+        self._reservations = {}
+        self._lock = threading.Lock()
+        for row in rows:
+            self.add(row)
+
+    def _apply(self, day, u_id, model, amount):
+        totals = self._days[day]
+        totals["total"] += amount
+        totals["users"][u_id] += amount
+        totals["models"][model] += amount
+
+    def _release(self, prompt_id):
+        reservation = self._reservations.pop(int(prompt_id), None)
+        if reservation is not None:
+            day, u_id, model, estimate = reservation
+            self._apply(day, u_id, model, -estimate)
+            self._days[day]["reserved"] -= estimate
+
+    def reserve(self, prompt_id, u_id, model, estimate):
+        """
+        Reserves the estimated cost of a prompt about to be staged
+
+        :raises BudgetExceeded: if the estimate would take the user, the
+        model or the day over its budget for today
+        """
+        with self._lock:
+            day = datetime.date.today()
+            totals = self._days[day]
+            if self.daily_budget is not None and totals["total"] + estimate > self.daily_budget:
+                raise BudgetExceeded(f"Staging would exceed the daily budget of ${self.daily_budget}")
+            if self.user_budget is not None and totals["users"].get(u_id, 0) + estimate > self.user_budget:
+                raise BudgetExceeded(f"Staging would exceed the daily budget of ${self.user_budget} for user {u_id}")
+            if self.model_budget is not None and totals["models"].get(model, 0) + estimate > self.model_budget:
+                raise BudgetExceeded(f"Staging would exceed the daily budget of ${self.model_budget} for {model}")
+            self._reservations[int(prompt_id)] = (day, u_id, model, estimate)
+            self._apply(day, u_id, model, estimate)
+            totals["reserved"] += estimate
+
+    def release(self, prompt_id):
+        """
+        Releases the reservation of a prompt which failed to be staged or stored
+        """
+        with self._lock:
+            self._release(prompt_id)
+
+    def add(self, row):
+        """
+        Adds the cost of a stored prompt, settling its reservation if it has one
+        """
+        with self._lock:
+            self._release(row.prompt_id)
+            self._apply(row.time.date(), row.u_id, row.model, row.cost)
+
+    def remove(self, row):
+        with self._lock:
+            self._apply(row.time.date(), row.u_id, row.model, -row.cost)
+
+    def totals(self, day):
+        """
+        The total spent on a day, and by each user and on each model,
+        including what is reserved by prompts still being staged
+        """
+        with self._lock:
+            totals = self._days.get(day)
+            if totals is None:
+                return {"total": 0.0, "reserved": 0.0, "users": {}, "models": {}}
+            return {
+                "total": totals["total"],
+                "reserved": totals["reserved"],
+                "users": dict(totals["users"]),
+                "models": dict(totals["models"])
+            }
+
+    def budgets(self):
+        return {"user": self.user_budget, "model": self.model_budget, "daily": self.daily_budget}
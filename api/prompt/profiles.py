@@ -0,0 +1,128 @@
+"""
+Immutable, interned model parameter profiles
+"""
+import threading
+import weakref
+
+
+class ParameterProfile(dict):
+    """
+    An immutable set of model parameters
+
+    Nested dicts are frozen into profiles and lists into tuples, so a
+    profile can be shared by any number of prompts and threads without
+    being copied. Changes are made with override(), which returns a new
+    profile sharing every value it does not replace with the original.
+
+    Profiles are dicts, so they can be passed to the AI API and stored
+    as JSON as they are.
+    """
+
+    __slots__ = ("_hash", "__weakref__")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__((key, freeze(value)) for key, value in dict(*args, **kwargs).items())
+        self._hash = None
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("ParameterProfile is immutable; use override() to change its parameters")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self.items()))
+        return self._hash
+
+    def __reduce__(self):
+        return ParameterProfile, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def override(self, **changes):
+        """
+        :return: a profile with changes applied over these parameters
+        """
+        changed = ParameterProfile.__new__(ParameterProfile)
+        # Only the changed values need freezing; the rest are shared as they are
+        dict.__init__(changed, self)
+        dict.update(changed, {key: freeze(value) for key, value in changes.items()})
+        changed._hash = None
+        return changed
+
+    def with_prompt(self, completion_type, prompt):
+        """
+        :return: a profile which submits prompt, as the content of the
+        last message for chat completions
+        """
+        if completion_type != "chat.completion":
+            return self.override(prompt=prompt)
+        messages = self.get("messages") or ({"role": "user"},)
+        return self.override(messages=messages[:-1] + (profile(messages[-1]).override(content=prompt),))
+
+    def thaw(self):
+        """
+        :return: a mutable deep copy of the parameters
+        """
+        return thaw(self)
+
+
+def freeze(value):
+    if isinstance(value, (ParameterProfile, str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, dict):
+        return profile(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def intern_key(value):
+    """
+    A key for value which is only equal to the key of an identical value
+
+    1, 1.0 and True are equal, as are 0 and False, so the type of every
+    value is part of the key and parameters are sent as they were given.
+    """
+    if isinstance(value, dict):
+        return frozenset((key, intern_key(item)) for key, item in value.items())
+    if isinstance(value, tuple):
+        return tuple(intern_key(item) for item in value)
+    return type(value), value
+
+
+_interned = weakref.WeakValueDictionary()
+_intern_lock = threading.Lock()
+
+
+def profile(parameters):
+    """
+    The shared profile of a set of parameters
+
+    Parameters equal in value and type give the same profile object for
+    as long as it is in use, so a base profile, and each frozen message and logit bias
+    within it, exists once however many prompts use it.
+    """
+    if isinstance(parameters, ParameterProfile):
+        return parameters
+    frozen = ParameterProfile(parameters)
+    try:
+        key = intern_key(frozen)
+    except TypeError:
+        # A parameter of a type which cannot be frozen; share nothing
+        return frozen
+    with _intern_lock:
+        return _interned.setdefault(key, frozen)
@@ -1,12 +1,16 @@
+import asyncio
+import contextlib
 import datetime
+import inspect
 import json
+import time
 
-import nltk
-from nltk.tokenize import word_tokenize
 import random
-from . import gpt_35_turbo, completion_default_params, per
-from .staging import BasicStaging
-# nltk.download("punkt")  # It's already downloaded rn
+from . import completion_default_params
+from .costs import cost, model_rates
+from .profiles import profile
+from .staging import BasicStaging, AsyncStaging
+from .tokens import default_token_counter
 
 
 def failed_gating_prompt():
@@ -17,6 +21,10 @@ def failed_annotation_verification_prompt(error):
     return f"Inform the user that the prompt failed annotation verification. \n{error}"
 
 
+# The stages whose latency is recorded in the triage report
+stages = ("gating", "annotation_verification", "layering", "vaccination", "submit")
+
+
 class Prompt:
 
     def __init__(self, u_id, prompt_id, completion_type, prompt="", **kwargs):
@@ -28,14 +36,18 @@ class Prompt:
         self["completion_type"] = completion_type
         self["overhead"] = kwargs.get("overhead", None)
         self["vaccinated_prompt"] = kwargs.get("vaccinated_prompt", None)
-        self["model_parameters"] = kwargs.get("model_parameters", completion_default_params)
+        # Stored rows whose parameters were lost have None in their place, and are shown with the defaults
+        parameters = kwargs.get("model_parameters")
+        if parameters is None:
+            parameters = completion_default_params
+        model_parameters = profile(parameters)
         if completion_type != "chat.completion":
-            self["model_parameters"]["prompt"] = prompt
+            model_parameters = model_parameters.with_prompt(completion_type, prompt)
         self["output"] = kwargs.get("output", None)
 
         # Non-data variables
         if completion_type == "chat.completion":
-            self.prompt = kwargs.get("model_parameters", {}).get("messages", [{}])[-1]
+            self.prompt = parameters.get("messages", [{}])[-1]
             self.prompt = self.prompt.get("content", "")
             self.starting_prompt = self.prompt
         else:
@@ -44,9 +56,15 @@ class Prompt:
 
         self.pre_layering = None
         self.post_layering = None
+        self.latencies = {}
         self.staging_procedure = kwargs.get("staging_procedure", BasicStaging)
-        self.rates = kwargs.get("rates", gpt_35_turbo)
+        self.rates = kwargs.get("rates")
+        self.cache_hit = False
+        self.token_counter = kwargs.get("token_counter") or default_token_counter(model_parameters.get("model"))
+        self.on_delta = kwargs.get("on_delta", None)
+        self.priority = kwargs.get("priority", "interactive")
         self._data.update(kwargs)
+        self["model_parameters"] = model_parameters
 
     def __getitem__(self, item):
         return self._data[item]
@@ -60,66 +78,178 @@ class Prompt:
     def dict(self):
         return self._data
 
+    def usage(self):
+        """
+        The token usage reported by the AI API, if it reported any
+        """
+        if isinstance(self["output"], dict):
+            return self["output"].get("usage")
+        return None
+
+    def cost_rates(self):
+        """
+        The rates the prompt is costed at, looked up from its model unless they were given
+
+        :raises UnknownModel: if the model has no rates
+        """
+        if self.rates is None:
+            self.rates = model_rates(self["model_parameters"].get("model"))
+        return self.rates
+
     def calc_cost(self):
-        return "{:.5f}".format(1/per * (
-            self.rates["prompt"] * (self["layering_input_tokens"] + self["vaccinated_prompt_tokens"]) +
-            + self.rates["completion"] * (self["layering_output_tokens"] + self["output_tokens"])
-        ))
+        if self.cache_hit:
+            # Answered from the response cache without calling the API
+            return 0.0
+        usage = self.usage()
+        if usage:
+            # Bill what the API says it billed
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens = self["layering_input_tokens"] + self["vaccinated_prompt_tokens"]
+            completion_tokens = self["layering_output_tokens"] + self["output_tokens"]
+        return cost(self.cost_rates(), prompt_tokens, completion_tokens)
 
-    def stage(self):
-        cls = self.staging_procedure(self["completion_type"], self["model_parameters"])
+    def estimate_cost(self, parameters):
+        """
+        The most the prompt may cost before it is staged, from its prompt
+        tokens and the completion tokens the parameters allow
+        """
+        completion_tokens = (parameters.get("max_tokens") or 0) * (parameters.get("n") or 1)
+        return cost(self.cost_rates(), self.token_counter.count(self.starting_prompt), completion_tokens)
+
+    @contextlib.contextmanager
+    def releasing_cost(self, cls):
+        """
+        Releases the cost reserved for the prompt if staging it fails
+        """
+        try:
+            yield
+        except BaseException:
+            if cls.cost_ledger is not None:
+                cls.cost_ledger.release(self["prompt_id"])
+            raise
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """
+        Records how long the enclosed stage takes, in seconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latencies[stage] = time.perf_counter() - start
+
+    def pipeline(self, cls):
+        """
+        The staging pipeline, as a generator which yields each stage to run
+        as (name, method, args) and is sent the stage's result in return
+        """
         processed_prompt = self.starting_prompt
+        cls.on_delta = self.on_delta
+        cls.priority = self.priority
+        # Models without rates are refused before anything is staged
+        self.cost_rates()
+        if cls.cost_ledger is not None:
+            cls.cost_ledger.reserve(
+                self["prompt_id"], self["u_id"], cls.parameters.get("model"), self.estimate_cost(cls.parameters)
+            )
 
-        gating_result = cls.gating(processed_prompt)
+        gating_result = yield "gating", cls.gating, (processed_prompt,)
         self["gating"] = gating_result
+        self["blocklist_version"] = cls.blocklist_version
         if gating_result.lower().startswith("blocked"):
             self["annotation_verification"] = "Cancelled"
             self["layering"] = "Cancelled"
             self["vaccination"] = "Cancelled"
             self["vaccinated_prompt"] = failed_gating_prompt()
         else:
-            for s in ["[]", "{}", "<>"]:
-                test = cls.annotation_verification(processed_prompt, s)
-                if test.lower().startswith("error"):
-                    break
+            test = yield "annotation_verification", cls.verify_annotations, (processed_prompt,)
             self["annotation_verification"] = test
             if test.lower().startswith("error:"):
                 self["layering"] = "Cancelled"
                 self["vaccination"] = "Cancelled"
                 self["vaccinated_prompt"] = failed_annotation_verification_prompt(self["annotation_verification"])
             else:
-                pre_processed_prompt, processed_prompt, result = cls.layering(processed_prompt)
+                pre_processed_prompt, processed_prompt, result = yield "layering", cls.layering, (processed_prompt,)
                 self.pre_layering = pre_processed_prompt
                 self["layering"] = result
                 self.post_layering = processed_prompt
-                processed_prompt, result = cls.vaccination(processed_prompt)
+                processed_prompt, result = yield "vaccination", cls.vaccination, (processed_prompt,)
                 self["vaccination"] = result
                 self["vaccinated_prompt"] = processed_prompt
 
-        if self["completion_type"] == "chat.completion":
-            cls.parameters["messages"][-1]["content"] = self["vaccinated_prompt"]
-        else:
-            cls.parameters["prompt"] = self["vaccinated_prompt"]
+        cls.parameters = cls.parameters.with_prompt(self["completion_type"], self["vaccinated_prompt"])
+        self["model_parameters"] = cls.parameters
+
+        self["output"] = yield "submit", cls.submit, ()
+        self.cache_hit = cls.cache_hit
+
+    def stage(self):
+        """
+        Runs the prompt through each stage of its staging procedure and
+        generates its triage report
 
-        self["output"] = cls.submit()
+        Asynchronous staging procedures are run to completion on a new
+        event loop; use astage() from within a running one.
+        """
+        if issubclass(self.staging_procedure, AsyncStaging):
+            return asyncio.run(self.astage())
+        cls = self.staging_procedure(self["completion_type"], self["model_parameters"])
+        pipeline = self.pipeline(cls)
+        result = None
+        with self.releasing_cost(cls):
+            try:
+                while True:
+                    stage, method, args = pipeline.send(result)
+                    with self.timed(stage):
+                        result = method(*args)
+            except StopIteration:
+                pass
+
+            self.generate_triage_report()
+
+    async def astage(self):
+        """
+        Stages the prompt as stage() does, awaiting any stage which
+        is a coroutine, such as an AsyncStaging submit
+        """
+        cls = self.staging_procedure(self["completion_type"], self["model_parameters"])
+        pipeline = self.pipeline(cls)
+        result = None
+        with self.releasing_cost(cls):
+            try:
+                while True:
+                    stage, method, args = pipeline.send(result)
+                    with self.timed(stage):
+                        result = method(*args)
+                        if inspect.isawaitable(result):
+                            result = await result
+            except StopIteration:
+                pass
 
-        self.generate_triage_report()
+            self.generate_triage_report()
 
     def generate_triage_report(self):
-        prompt_tokens = len(word_tokenize(self.prompt))
-        vaccinated_prompt_tokens = len(word_tokenize(self["vaccinated_prompt"]))
+        count = self.token_counter.count
+        prompt_tokens = count(self.prompt)
+        vaccinated_prompt_tokens = count(self["vaccinated_prompt"])
         overhead = vaccinated_prompt_tokens - prompt_tokens
 
-        layering_input_tokens = len(word_tokenize(self.pre_layering))
-        layering_output_tokens = len(word_tokenize(self.post_layering))
+        layering_input_tokens = count(self.pre_layering)
+        layering_output_tokens = count(self.post_layering)
         layering_overhead = layering_output_tokens - prompt_tokens
 
         layering_to_vaccinated_overhead = vaccinated_prompt_tokens - layering_output_tokens
 
-        if self["completion_type"] == "chat.completion":
-            output_tokens = len(word_tokenize(self["output"]["choices"][0]["message"]["content"]))
+        usage = self.usage()
+        if usage and "completion_tokens" in usage:
+            output_tokens = usage["completion_tokens"]
+        elif self["completion_type"] == "chat.completion":
+            output_tokens = count(self["output"]["choices"][0]["message"]["content"])
         else:
-            output_tokens = len(word_tokenize(self["output"]["choices"][0]["text"]))
+            output_tokens = count(self["output"]["choices"][0]["text"])
 
         new_data = {
             'u_id': self["u_id"],
@@ -132,11 +262,12 @@ class Prompt:
             'vaccinated_prompt_tokens': vaccinated_prompt_tokens,
             'overhead': overhead,
             'layering_input_tokens': layering_input_tokens,
-            'layering_output': self.post_layering,
+            'layering_output': self.post_layering or "",
             'layering_output_tokens': layering_output_tokens,
             'layering_overhead': layering_overhead,
             'layering_to_vaccinated_overhead': layering_to_vaccinated_overhead,
             'gating': self['gating'],
+            'blocklist_version': self._data.get('blocklist_version'),
             'annotation_verification': self['annotation_verification'],
             'layering': self['layering'],
             'vaccination': self['vaccination'],
@@ -144,7 +275,13 @@ class Prompt:
             'output': self["output"],
             'output_tokens': output_tokens,
             "cost": None,
-            'model_parameters': self["model_parameters"]
+            'model_parameters': self["model_parameters"],
+            'model': self["model_parameters"].get("model"),
+            'gating_latency': self.latencies.get("gating"),
+            'annotation_verification_latency': self.latencies.get("annotation_verification"),
+            'layering_latency': self.latencies.get("layering"),
+            'vaccination_latency': self.latencies.get("vaccination"),
+            'submit_latency': self.latencies.get("submit")
         }
         self._data = new_data
         self._data["cost"] = self.calc_cost()
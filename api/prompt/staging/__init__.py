@@ -2,5 +2,10 @@ import openai
 import os
 from .staging import Staging
 from .basic_staging import BasicStaging
+from .async_staging import AsyncStaging, AsyncBasicStaging
+from .clients import OpenAIClient, MockClient
+from .gating import GatingMatcher, Blocklist
+from .response_cache import ResponseCache
+from .scheduler import UpstreamScheduler, TokenBucket, priority_classes
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -0,0 +1,108 @@
+"""
+Single-pass annotation verification
+"""
+import functools
+import re
+
+default_delimiters = ("[]", "{}", "<>")
+
+
+@functools.lru_cache(maxsize=None)
+def tag_pattern(delimiters):
+    """
+    A regex matching opening and closing tags of every delimiter pair,
+    with a (slashes, name) group pair for each of them in order
+    """
+    return re.compile("|".join(
+        re.escape(lr[0]) + r"(/*)([\w\-\s]+)" + re.escape(lr[1]) for lr in delimiters
+    ))
+
+
+class _FamilyState:
+    """
+    What has been seen so far of the tags of one delimiter pair
+    """
+
+    def __init__(self, lr):
+        self.lr = lr
+        self.tags = 0
+        self.closing = 0
+        self.opened = {}
+        self.closed = {}
+        self.stack = []
+        self.in_stack = {}
+        self.nesting_errors = {}
+
+    def open_tag(self, name):
+        self.tags += 1
+        self.opened[name] = self.opened.get(name, 0) + 1
+        if self.in_stack.get(name):
+            self.nesting_errors.setdefault(name, f"Error: tag '{name}' overlaps with '{name}'.")
+        self.stack.append(name)
+        self.in_stack[name] = self.in_stack.get(name, 0) + 1
+
+    def close_tag(self, slashes, name):
+        self.tags += 1
+        self.closing += 1
+        if slashes != 1:
+            # Only [/tag] closes [tag]; [//tag] is counted as a closing tag but matches nothing
+            return
+        self.closed[name] = self.closed.get(name, 0) + 1
+        if not self.in_stack.get(name):
+            self.nesting_errors.setdefault(
+                name, f"Error: closing tag '{self.lr[0]}/{name}{self.lr[1]}' appears before '{self.lr[0]}{name}{self.lr[1]}'."
+            )
+            return
+        if self.stack[-1] != name:
+            self.nesting_errors.setdefault(name, f"Error: tag '{self.stack[-1]}' overlaps with '{name}'.")
+        # Close the most recent [name], dropping any unclosed tags opened inside it
+        while True:
+            popped = self.stack.pop()
+            self.in_stack[popped] -= 1
+            if popped == name:
+                break
+
+    def result(self):
+        if self.tags % 2:
+            return "Error: uneven number of tags."
+        for name, count in self.opened.items():
+            if count != self.closed.get(name, 0):
+                return f"Error: unequal number of closing and opening tags for {name}."
+        if self.closing != self.tags // 2:
+            return "Error: unequal distribution of opening and closing tags."
+        # Report nesting errors in the order their tags were first opened
+        for name in self.opened:
+            if name in self.nesting_errors:
+                return self.nesting_errors[name]
+        return "Pass"
+
+
+def verify_annotations(prompt, delimiters=default_delimiters):
+    """
+    Checks the annotations of a string for signs of forgery, for every
+    pair of delimiters in a single linear scan
+
+    Each pair of delimiters is checked independently, in order, for
+    an uneven number of tags, unequal numbers of each opening and
+    closing tag, unequal numbers of opening and closing tags overall,
+    and finally for tags which are closed before they are opened or
+    which overlap one another.
+
+    :param prompt: the text which is being checked for signs of forgery
+    :param delimiters: the pairs of characters used to wrap annotation tags
+    :return: the first error found, or "Pass"
+    """
+    delimiters = tuple(delimiters)
+    families = [_FamilyState(lr) for lr in delimiters]
+    for match in tag_pattern(delimiters).finditer(prompt):
+        family = families[(match.lastindex - 1) // 2]
+        slashes, name = match.group(match.lastindex - 1, match.lastindex)
+        if slashes:
+            family.close_tag(len(slashes), name)
+        else:
+            family.open_tag(name)
+    for family in families:
+        result = family.result()
+        if result != "Pass":
+            return result
+    return "Pass"
@@ -0,0 +1,55 @@
+import abc
+
+from .basic_staging import BasicStaging
+from .staging import Staging
+from .streaming import assemble_async_stream
+
+
+class AsyncStaging(Staging):
+    """
+    The base class for staging strategies which await the AI API on
+    an event loop rather than blocking a thread
+
+    submit is a coroutine, and any other stage may be one too; Prompt.astage
+    awaits whichever of them are.
+    """
+
+    @abc.abstractmethod
+    async def submit(self, prompt=None):
+        """
+        The awaitable call to the AI API
+        """
+        pass
+
+
+class AsyncBasicStaging(AsyncStaging, BasicStaging):
+    """
+    Basic staging which awaits its submission to the AI API
+    """
+
+    async def submit(self, prompt=None):
+        """
+        Submits the prompt to the AI API using set parameters
+
+        Identical submissions are answered from the response
+        cache instead, if one is set, and submissions wait their
+        turn with the scheduler, if one is set. Streamed completions are relayed
+        to on_delta as they arrive and returned once assembled.
+        """
+        if self.completion_type != "chat.completion" and prompt is not None:
+            self.parameters = self.parameters.with_prompt(self.completion_type, prompt)
+        cache = self.cache()
+        response = cache.get(self.parameters) if cache is not None else None
+        self.cache_hit = response is not None
+        if response is None:
+            if self.scheduler is not None:
+                response = await self.scheduler.async_call(
+                    self.parameters, self.priority, self.client.acreate, self.completion_type, **self.parameters
+                )
+            else:
+                response = await self.client.acreate(self.completion_type, **self.parameters)
+            if self.parameters.get("stream"):
+                response = await assemble_async_stream(self.completion_type, response, self.on_delta)
+            if cache is not None:
+                cache.set(self.parameters, response)
+        return response
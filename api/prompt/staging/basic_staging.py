@@ -1,8 +1,8 @@
-import openai
-
 from .._data import blocklist
+from .annotations import tag_pattern, verify_annotations
+from .gating import Blocklist
 from .staging import Staging
-import re
+from .streaming import assemble_stream
 
 
 class BasicStaging(Staging):
@@ -10,12 +10,14 @@ class BasicStaging(Staging):
     Basic staging with gating of mild language and annotation verification
     """
 
+    gating_blocklist = Blocklist(blocklist)
+
     def __init__(self, completion_type, parameters):
         super().__init__(completion_type, parameters)
 
     def gating(self, prompt):
-        prompt = prompt.lower().split()
-        if any([blocked in prompt for blocked in blocklist]):
+        self.blocklist_version, matcher = self.gating_blocklist.snapshot()
+        if matcher.match(prompt) is not None:
             return "Blocked"
         return "Pass"
 
@@ -28,76 +30,16 @@ class BasicStaging(Staging):
         :param log: whether or not to display logs
         :return: check result
         """
-        pattern = f"\\{lr[0]}/*[\\w\\-\\s]+\\{lr[1]}"
-        tag_re = re.compile(pattern)  # Finds [tag] and [/tag]
-
-        # Construct tags
-        def open_tag(tag):
-            return lr[0] + tag + lr[1]
-
-        def close_tag(tag):
-            return lr[0] + "/" + tag + lr[1]
-
-        # Construct regices
-        def make_open_re(tag):
-            return "\\" + lr[0] + tag + "\\" + lr[1]
-
-        def make_close_re(tag):
-            return "\\" + lr[0] + "/" + tag + "\\" + lr[1]
-
-        def find_all_tags(pattern, string):
-            n = 0
-            output = []
-            while n < len(string):
-                tag = pattern.search(string[n:])
-                if tag is None:
-                    break
-                output.append(tag.group(0)[1:-1])
-                n = n + tag.span()[1]
-            return output
-
-        # Gather tags
-        tags = find_all_tags(tag_re, prompt)
         if log:
             print(f"user input:\n{prompt}")
-            print("tags:", tags)
-        only_open_tags = [tag for tag in tags if "/" not in tag]
-
-        # Check for uneven number of tags, the most obvious sign of annotation forgery.
-        if len(tags) % 2:
-            return f"Error: uneven number of tags."
+            print("tags:", [tag.group(0)[1:-1] for tag in tag_pattern((lr,)).finditer(prompt)])
+        return verify_annotations(prompt, (lr,))
 
-        # Check that there is a corresponding [/tag] for every [tag]
-        for tag in only_open_tags:
-            if prompt.count(open_tag(tag)) != prompt.count(close_tag(tag)):
-                return f"Error: unequal number of closing and opening tags for {tag}."
-
-        # Check that there is an equal amount of opening and closing tags
-        tag_count = sum([1 for tag in tags if "/" in tag])
-        if tag_count != len(tags) // 2:
-            return f"Error: unequal distribution of opening and closing tags."
-
-        # Check that there are no overlapping tags
-        for tag_a in only_open_tags:
-            tmp = prompt
-            n = 0
-            count = only_open_tags.count(tag_a)
-            while n < count:
-                open_point = re.search(make_open_re(tag_a), tmp).span()[0]
-                close_point = re.search(make_close_re(tag_a), tmp).span()[1]
-                if open_point >= close_point:
-                    return f"Error: closing tag '{lr[0]}/{tag_a}{lr[1]}' appears before '{lr[0]}{tag_a}{lr[1]}'."
-                substring = tmp[open_point:close_point]
-                for tag_b in only_open_tags:
-                    if tag_a != tag_b and (
-                            (open_tag(tag_b) in substring and close_tag(tag_b) not in substring)
-                            or
-                            (close_tag(tag_b) in substring and open_tag(tag_b) not in substring)
-                    ):
-                        return f"Error: tag '{tag_b}' overlaps with '{tag_a}'."
-                n += 1
-                tmp = tmp[close_point:]
-        return "Pass"
+    def verify_annotations(self, prompt):
+        """
+        Checks the annotations of every delimiter pair in one pass
+        """
+        return verify_annotations(prompt, self.annotation_delimiters)
 
     def layering(self, prompt):
         """
@@ -109,11 +51,35 @@ class BasicStaging(Staging):
     def vaccination(self, prompt):
         return "[input]" + prompt + "[/input]", "Complete"
 
+    def cache(self):
+        """
+        The response cache to use for the current parameters, if any
+        """
+        return self.response_cache if not self.parameters.get("stream") else None
+
     def submit(self, prompt=None):
         """
         Submits the prompt to the AI API using set parameters
+
+        Identical submissions are answered from the response
+        cache instead, if one is set, and submissions wait their
+        turn with the scheduler, if one is set. Streamed completions are relayed
+        to on_delta as they arrive and returned once assembled.
         """
-        if self.completion_type == "chat.completion":
-            return openai.ChatCompletion.create(**self.parameters)
-        self.parameters["prompt"] = prompt
-        return openai.Completion.create(**self.parameters)
+        if self.completion_type != "chat.completion" and prompt is not None:
+            self.parameters = self.parameters.with_prompt(self.completion_type, prompt)
+        cache = self.cache()
+        response = cache.get(self.parameters) if cache is not None else None
+        self.cache_hit = response is not None
+        if response is None:
+            if self.scheduler is not None:
+                response = self.scheduler.call(
+                    self.parameters, self.priority, self.client.create, self.completion_type, **self.parameters
+                )
+            else:
+                response = self.client.create(self.completion_type, **self.parameters)
+            if self.parameters.get("stream"):
+                response = assemble_stream(self.completion_type, response, self.on_delta)
+            if cache is not None:
+                cache.set(self.parameters, response)
+        return response
@@ -0,0 +1,177 @@
+"""
+Clients for the AI API which staging submits prompts to
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+import openai
+
+from ..tokens import default_token_counter
+
+
+class OpenAIClient:
+    """
+    Submits to the OpenAI API
+    """
+
+    def create(self, completion_type, **parameters):
+        if completion_type == "chat.completion":
+            return openai.ChatCompletion.create(**parameters)
+        return openai.Completion.create(**parameters)
+
+    async def acreate(self, completion_type, **parameters):
+        if completion_type == "chat.completion":
+            return await openai.ChatCompletion.acreate(**parameters)
+        return await openai.Completion.acreate(**parameters)
+
+
+# The words mock completions are made of
+mock_vocabulary = (
+    "the", "prompt", "model", "answer", "request", "token", "stage", "pulse", "safe", "input",
+    "output", "result", "report", "value", "simple", "clear", "quick", "local", "test", "reply"
+)
+
+
+class MockClient:
+    """
+    A local stand-in for the AI API, for exercising staging under load
+    without network access
+
+    Completions are derived from a hash of the parameters, so the same
+    submission always gets the same completion, and are as long as
+    max_tokens allows. Responses carry a usage block counted with the
+    model's default token counter.
+
+    Latencies and failures are drawn from a generator seeded with seed,
+    so a run submitting in a fixed order sees the same sequence of them.
+
+    :param latency: the mean time to respond, in seconds
+    :param distribution: how latencies vary around the mean; "fixed", "uniform" (from 0 to twice the mean), "exponential" or "lognormal"
+    :param sigma: the standard deviation of the log of a lognormal latency
+    :param error_rate: the fraction of submissions which fail with one of errors
+    :param errors: the openai error types failures are drawn from
+    :param usage: whether responses include a usage block
+    :param seed: the seed for latencies and failures
+    """
+
+    def __init__(self, latency=0.0, distribution="fixed", sigma=0.5, error_rate=0.0,
+                 errors=(openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.APIError),
+                 usage=True, seed=0):
+        if distribution not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency = latency
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.usage = usage
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        """
+        Draws the latency and outcome of the next submission
+        """
+        with self._lock:
+            self.calls += 1
+            if self.distribution == "fixed" or not self.latency:
+                latency = self.latency
+            elif self.distribution == "uniform":
+                latency = self._random.uniform(0, 2 * self.latency)
+            elif self.distribution == "exponential":
+                latency = self._random.expovariate(1 / self.latency)
+            else:
+                # Shifted so the mean of the distribution is the mean latency
+                latency = self._random.lognormvariate(0, self.sigma) * self.latency / math.exp(self.sigma ** 2 / 2)
+            error = None
+            if self.error_rate and self._random.random() < self.error_rate:
+                error = self._random.choice(self.errors)
+        return latency, error
+
+    def completion(self, parameters):
+        """
+        The deterministic completion text for a submission
+        """
+        # Streamed or not, a submission gets the same completion
+        submission = {key: value for key, value in parameters.items() if key != "stream"}
+        key = json.dumps(submission, sort_keys=True, default=str).encode("utf-8")
+        digest = hashlib.sha256(key).digest()
+        length = max(1, min(parameters.get("max_tokens") or 16, len(digest)))
+        return " ".join(mock_vocabulary[byte % len(mock_vocabulary)] for byte in digest[:length])
+
+    def response(self, completion_type, parameters):
+        """
+        The response to a submission, in the shape the AI API returns
+        """
+        counter = default_token_counter(parameters.get("model"))
+        text = self.completion(parameters)
+        if completion_type == "chat.completion":
+            prompt_tokens = sum(counter.count(message.get("content")) for message in parameters.get("messages", []))
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "length"}
+        else:
+            prompt_tokens = counter.count(parameters.get("prompt"))
+            choice = {"index": 0, "text": text, "logprobs": None, "finish_reason": "length"}
+        response = {
+            "id": "mock-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:24],
+            "object": "chat.completion" if completion_type == "chat.completion" else "text_completion",
+            "created": int(time.time()),
+            "model": parameters.get("model"),
+            "choices": [choice]
+        }
+        if self.usage:
+            completion_tokens = counter.count(text)
+            response["usage"] = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        return response
+
+    def chunks(self, completion_type, response):
+        """
+        Splits a response into the chunks the AI API streams it as
+        """
+        choice = response["choices"][0]
+        text = choice["message"]["content"] if completion_type == "chat.completion" else choice["text"]
+        pieces = [word if i == 0 else " " + word for i, word in enumerate(text.split(" "))]
+        header = {key: response[key] for key in ("id", "created", "model")}
+        if completion_type == "chat.completion":
+            header["object"] = "chat.completion.chunk"
+            yield {**header, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+            for piece in pieces:
+                yield {**header, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield {**header, "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]}
+        else:
+            header["object"] = "text_completion"
+            for piece in pieces:
+                yield {**header, "choices": [{"index": 0, "text": piece, "logprobs": None, "finish_reason": None}]}
+            yield {**header, "choices": [{"index": 0, "text": "", "logprobs": None, "finish_reason": choice["finish_reason"]}]}
+
+    def create(self, completion_type, **parameters):
+        latency, error = self._draw()
+        time.sleep(latency)
+        if error is not None:
+            raise error("Mock upstream error")
+        response = self.response(completion_type, parameters)
+        if parameters.get("stream"):
+            return self.chunks(completion_type, response)
+        return response
+
+    async def acreate(self, completion_type, **parameters):
+        latency, error = self._draw()
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error("Mock upstream error")
+        response = self.response(completion_type, parameters)
+        if parameters.get("stream"):
+            async def chunks():
+                for chunk in self.chunks(completion_type, response):
+                    yield chunk
+            return chunks()
+        return response
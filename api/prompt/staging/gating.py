@@ -0,0 +1,172 @@
+"""
+Blocklist matching for gating
+"""
+import collections
+import glob
+import hashlib
+import os
+import threading
+import time
+
+
+class GatingMatcher:
+    """
+    Matches the words of a prompt against a blocklist of words and
+    phrases in a single pass
+
+    The blocklist is compiled into an Aho-Corasick automaton over
+    whitespace-separated, lowercased words, so a prompt is checked in
+    time linear in its length however many terms are blocked. As with
+    plain word gating, terms only match whole words.
+    """
+
+    def __init__(self, terms):
+        self.terms = 0
+        # Node 0 is the root; each node has its word transitions, failure link and matched term
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        for term in terms:
+            self._add(term)
+        self._link()
+
+    def __len__(self):
+        return self.terms
+
+    def _add(self, term):
+        words = term.lower().split()
+        if not words:
+            return
+        node = 0
+        for word in words:
+            if word not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._goto[node][word] = len(self._goto) - 1
+            node = self._goto[node][word]
+        if self._output[node] is None:
+            self.terms += 1
+        self._output[node] = term
+
+    def _link(self):
+        queue = collections.deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(word, 0)
+                # A node also matches whatever its longest matching suffix matches
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def match(self, prompt):
+        """
+        :return: the first blocked term found in the prompt, or None
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for word in prompt.lower().split():
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            if output[node] is not None:
+                return output[node]
+        return None
+
+
+def read_blocklist(path):
+    """
+    Reads blocked terms from a file, or from every .txt file in a directory,
+    one term per line with blank lines and #-comments ignored
+    """
+    paths = sorted(glob.glob(os.path.join(path, "*.txt"))) if os.path.isdir(path) else [path]
+    terms = []
+    for file_path in paths:
+        with open(file_path, encoding="utf-8") as f:
+            terms.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+    return terms
+
+
+def blocklist_version(terms):
+    """
+    The version of a set of terms, as they are matched
+
+    The version is a hash of the normalised terms, so the same terms
+    have the same version in every process and across restarts, and it
+    fits the 32-bit integer column it is stored in.
+    """
+    normalised = sorted({" ".join(term.lower().split()) for term in terms} - {""})
+    digest = hashlib.sha256("\n".join(normalised).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7fffffff
+
+
+class Blocklist:
+    """
+    A versioned, compiled blocklist which can be reloaded from files
+    without interrupting gating
+
+    A reload compiles a new GatingMatcher off to the side and then
+    swaps it in with its version in one assignment, so gating always
+    sees a consistent (version, matcher) pair. Versions identify the
+    terms themselves, so reloading unchanged terms keeps the version.
+    """
+
+    def __init__(self, terms=(), path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._watcher = None
+        self._current = (0, None)
+        if path:
+            self.load()
+        else:
+            self._current = (blocklist_version(terms), GatingMatcher(terms))
+
+    @property
+    def version(self):
+        return self._current[0]
+
+    def snapshot(self):
+        """
+        :return: the current (version, matcher) pair
+        """
+        return self._current
+
+    def _files_signature(self):
+        paths = sorted(glob.glob(os.path.join(self.path, "*.txt"))) if os.path.isdir(self.path) else [self.path]
+        return tuple((path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths)
+
+    def load(self):
+        """
+        Recompiles the blocklist from its path and swaps it in
+
+        :return: the new version
+        """
+        with self._lock:
+            signature = self._files_signature()
+            terms = read_blocklist(self.path)
+            self._signature = signature
+            self._current = (blocklist_version(terms), GatingMatcher(terms))
+            return self._current[0]
+
+    def watch(self, interval=5):
+        """
+        Starts a background thread which reloads the blocklist whenever its files change
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self._files_signature() != self._signature:
+                        self.load()
+                except OSError:
+                    # Files mid-replacement; try again next interval and keep the current version
+                    pass
+
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=run, name="pulse-blocklist", daemon=True)
+            self._watcher.start()
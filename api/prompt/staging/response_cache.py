@@ -0,0 +1,167 @@
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def parameters_key(parameters):
+    """
+    A canonical hash of model parameters, independent of key order
+    """
+    canonical = json.dumps(parameters, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """
+    Keeps cached responses in an in-process LRU ordered dict
+    """
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, stored_at, value):
+        self.delete(key)
+        self._entries[key] = (stored_at, value)
+        self.size += len(value)
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def evict(self, max_entries, max_bytes):
+        while self._entries and (len(self._entries) > max_entries or (max_bytes and self.size > max_bytes)):
+            _, (_, value) = self._entries.popitem(last=False)
+            self.size -= len(value)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+
+class SqliteBackend:
+    """
+    Keeps cached responses in a SQLite file, so they survive restarts
+    and can be shared between processes
+    """
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, accessed_at REAL NOT NULL, value TEXT NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size(self):
+        return self._connection.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        entry = self._connection.execute("SELECT stored_at, value FROM responses WHERE key = ?", (key,)).fetchone()
+        if entry is not None:
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return entry
+
+    def set(self, key, stored_at, value):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, stored_at, accessed_at, value) VALUES (?, ?, ?, ?)",
+            (key, stored_at, time.time(), value)
+        )
+
+    def delete(self, key):
+        self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self, max_entries, max_bytes):
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        )
+        if max_bytes:
+            # Keeps the most recently used responses which fit in max_bytes, in one pass
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM "
+                "(SELECT key, SUM(LENGTH(value)) OVER (ORDER BY accessed_at DESC, key) AS kept FROM responses) "
+                "WHERE kept > ?)",
+                (max_bytes,)
+            )
+
+    def clear(self):
+        self._connection.execute("DELETE FROM responses")
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed on the exact parameters they were
+    requested with
+
+    Entries are evicted least-recently-used first once there are more
+    than max_entries of them or they take up more than max_bytes, and
+    expire ttl seconds after they were stored. Responses are kept in
+    memory unless a path is given, in which case they are kept in a
+    SQLite file at that path.
+    """
+
+    def __init__(self, max_entries=4096, ttl=3600, max_bytes=None, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.backend = SqliteBackend(path) if path else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, parameters):
+        """
+        :return: the cached response for the parameters, or None
+        """
+        key = parameters_key(parameters)
+        with self._lock:
+            entry = self.backend.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self.backend.delete(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(entry[1])
+
+    def set(self, parameters, response):
+        value = json.dumps(response)
+        with self._lock:
+            self.backend.set(parameters_key(parameters), time.time(), value)
+            self.backend.evict(self.max_entries, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.backend),
+                "bytes": self.backend.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0
+            }
@@ -0,0 +1,304 @@
+"""
+Rate-limited scheduling of submissions to the AI API
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+
+import openai
+
+from .._data import api_rates, default_rate_limits
+from ..costs import lookup_rates
+from ..tokens import default_token_counter
+
+# Lower classes are granted first when submissions are queued for a model
+priority_classes = {"interactive": 0, "batch": 1, "background": 2}
+
+
+class TokenBucket:
+    """
+    Allows an amount per minute, refilled continuously, with up to
+    burst seconds' worth saved up
+
+    A request larger than the bucket waits for it to fill and then
+    leaves it in debt, so large requests are paced too.
+    """
+
+    def __init__(self, per_minute, burst=1.0):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """
+        Seconds until amount can be taken
+        """
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= amount
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    """
+    A submission queued for a model's buckets, woken from any thread
+    """
+
+    def __init__(self, key, tokens, loop=None):
+        self.key = key
+        self.tokens = tokens
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def arm(self):
+        if self.loop is None:
+            self.event.clear()
+        else:
+            self.event = self.loop.create_future()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve, self.event)
+
+    @staticmethod
+    def _resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+
+class _ModelLimiter:
+    """
+    The request and token buckets of one model, and the submissions
+    queued for them in order of priority and arrival
+    """
+
+    def __init__(self, rpm, tpm, burst):
+        self.requests = TokenBucket(rpm, burst)
+        self.tokens = TokenBucket(tpm, burst)
+        self.queue = []
+        self.stats = {"granted": 0, "rate_limited": 0, "retries": 0, "waited": 0.0}
+
+    def try_grant(self, waiter):
+        """
+        Grants the waiter if it is first in the queue and both buckets allow it
+
+        :return: None once granted, otherwise seconds until it might be
+        """
+        if self.queue[0] is not waiter:
+            return math.inf
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        delay = max(self.requests.delay(1), self.tokens.delay(waiter.tokens))
+        if delay > 0:
+            return delay
+        self.requests.take(1)
+        self.tokens.take(waiter.tokens)
+        heapq.heappop(self.queue)
+        self.stats["granted"] += 1
+        if self.queue:
+            self.queue[0].wake()
+        return None
+
+    def withdraw(self, waiter):
+        head = self.queue[0] is waiter
+        self.queue.remove(waiter)
+        heapq.heapify(self.queue)
+        if head and self.queue:
+            self.queue[0].wake()
+
+    def throttle(self):
+        """
+        Pauses every queued submission after the API reports a rate limit
+        """
+        self.requests.drain()
+        self.tokens.drain()
+        self.stats["rate_limited"] += 1
+
+
+def request_tokens(parameters):
+    """
+    The tokens a submission counts against its model's limit: its prompt
+    and as many completion tokens as it may generate
+    """
+    count = default_token_counter(parameters.get("model")).count
+    if "messages" in parameters:
+        prompt_tokens = sum(count(message.get("content")) for message in parameters["messages"])
+    else:
+        prompt_tokens = count(parameters.get("prompt"))
+    return prompt_tokens + (parameters.get("max_tokens") or 16) * (parameters.get("n") or 1)
+
+
+def retryable(error):
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                          openai.error.APIConnectionError, openai.error.Timeout, openai.error.TryAgain)):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status is None or error.http_status >= 500)
+
+
+class UpstreamScheduler:
+    """
+    Paces submissions to each model to its requests and tokens per
+    minute, as listed in the API rates, and retries those which fail
+    transiently
+
+    Submissions wait their turn in each model's queue, interactive
+    before batch before background, so bursts are smoothed out to the
+    provider's limit rather than being sent at once and rejected. A
+    rate limit error drains the model's buckets, pausing everything
+    queued behind it, and is retried with jittered exponential backoff
+    like any other transient error.
+
+    :param burst: seconds' worth of requests and tokens which may be sent at once
+    :param max_retries: times a submission is retried before its error is raised
+    :param backoff: the backoff before the first retry, in seconds, doubling with each retry
+    :param max_backoff: the longest backoff between retries, in seconds
+    """
+
+    def __init__(self, rates=api_rates, burst=1.0, max_retries=6, backoff=0.5, max_backoff=30.0):
+        self.rates = rates
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._limiters = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def limiter(self, model):
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = lookup_rates(self.rates, model) or default_rate_limits
+            limiter = self._limiters.setdefault(model, _ModelLimiter(limits["rpm"], limits["tpm"], self.burst))
+        return limiter
+
+    def _enqueue(self, limiter, parameters, priority, loop=None):
+        key = (priority_classes.get(priority, priority_classes["background"]), next(self._sequence))
+        waiter = _Waiter(key, request_tokens(parameters), loop)
+        heapq.heappush(limiter.queue, waiter)
+        return waiter
+
+    def acquire(self, parameters, priority="interactive"):
+        """
+        Blocks until a submission with these parameters may be sent
+        """
+        start = time.monotonic()
+        with self._lock:
+            limiter = self.limiter(parameters.get("model"))
+            waiter = self._enqueue(limiter, parameters, priority)
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    delay = limiter.try_grant(waiter)
+                    if delay is None:
+                        granted = True
+                        limiter.stats["waited"] += time.monotonic() - start
+                        return
+                    waiter.arm()
+                waiter.event.wait(None if delay == math.inf else delay)
+        finally:
+            if not granted:
+                with self._lock:
+                    limiter.withdraw(waiter)
+
+    async def async_acquire(self, parameters, priority="interactive"):
+        """
+        Waits on the event loop until a submission with these parameters may be sent
+        """
+        start = time.monotonic()
+        with self._lock:
+            limiter = self.limiter(parameters.get("model"))
+            waiter = self._enqueue(limiter, parameters, priority, asyncio.get_running_loop())
+        granted = False
+        try:
+            while True:
+                with self._lock:
+                    delay = limiter.try_grant(waiter)
+                    if delay is None:
+                        granted = True
+                        limiter.stats["waited"] += time.monotonic() - start
+                        return
+                    waiter.arm()
+                await asyncio.wait([waiter.event], timeout=None if delay == math.inf else delay)
+        finally:
+            if not granted:
+                with self._lock:
+                    limiter.withdraw(waiter)
+
+    def _retry_delay(self, limiter, error, attempt):
+        """
+        The backoff before retrying after error, or None if it should be raised
+        """
+        if attempt >= self.max_retries or not retryable(error):
+            return None
+        with self._lock:
+            limiter.stats["retries"] += 1
+            if isinstance(error, openai.error.RateLimitError):
+                limiter.throttle()
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def call(self, parameters, priority, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) to submit with these parameters once
+        the model's limits allow, retrying transient errors
+        """
+        limiter = self.limiter(parameters.get("model"))
+        for attempt in itertools.count():
+            self.acquire(parameters, priority)
+            try:
+                return fn(*args, **kwargs)
+            except openai.error.OpenAIError as error:
+                delay = self._retry_delay(limiter, error, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def async_call(self, parameters, priority, fn, *args, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) as call() calls it
+        """
+        limiter = self.limiter(parameters.get("model"))
+        for attempt in itertools.count():
+            await self.async_acquire(parameters, priority)
+            try:
+                return await fn(*args, **kwargs)
+            except openai.error.OpenAIError as error:
+                delay = self._retry_delay(limiter, error, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: {
+                    **limiter.stats,
+                    "queued": len(limiter.queue),
+                    "requests_available": limiter.requests.level,
+                    "tokens_available": limiter.tokens.level
+                }
+                for model, limiter in self._limiters.items()
+            }
@@ -1,5 +1,8 @@
 import abc
 
+from ..profiles import profile
+from .clients import OpenAIClient
+
 
 class Staging(abc.ABC):
     """
@@ -9,9 +12,36 @@ class Staging(abc.ABC):
     Create a subclass of this to implement a staging strategy
     """
 
+    # The client prompts are submitted with; swap in a MockClient to stage offline
+    client = OpenAIClient()
+
+    # Opt-in UpstreamScheduler which paces submissions to the API's rate limits
+    scheduler = None
+
+    # The priority class of the prompt's submission, if it is scheduled
+    priority = "interactive"
+
+    # Opt-in ResponseCache consulted before submitting to the AI API
+    response_cache = None
+
+    # Opt-in CostLedger whose budgets prompts are checked against before they are staged
+    cost_ledger = None
+
+    # Whether the submission was answered from the response cache, at no cost
+    cache_hit = False
+
+    # The characters which may be used to wrap annotation tags
+    annotation_delimiters = ("[]", "{}", "<>")
+
+    # The version of the blocklist the prompt was gated against, if gating uses one
+    blocklist_version = None
+
+    # Called with (choice index, text) as each piece of a streamed completion arrives
+    on_delta = None
+
     def __init__(self, completion_type, parameters):
         self.completion_type = completion_type
-        self.parameters = parameters
+        self.parameters = profile(parameters)
 
     @abc.abstractmethod
     def gating(self, prompt):
@@ -30,6 +60,18 @@ class Staging(abc.ABC):
         """
         return prompt
 
+    def verify_annotations(self, prompt):
+        """
+        Verifies the annotations wrapped in each of the annotation
+        delimiters in turn, stopping at the first error
+        """
+        result = "Pass"
+        for lr in self.annotation_delimiters:
+            result = self.annotation_verification(prompt, lr)
+            if result.lower().startswith("error"):
+                break
+        return result
+
     @abc.abstractmethod
     def layering(self, prompt):
         """
@@ -0,0 +1,87 @@
+"""
+Assembly of streamed completions
+"""
+import time
+
+
+class StreamedResponse:
+    """
+    Collects the chunks of a streamed completion into the response
+    the AI API would have returned had it not been streamed
+
+    :param completion_type: the prompt's completion type, "chat.completion" for chat models
+    :param on_delta: called with (choice index, text) as each piece of text arrives
+    """
+
+    def __init__(self, completion_type, on_delta=None):
+        self.completion_type = completion_type
+        self.on_delta = on_delta
+        self.response = None
+        self.choices = {}
+
+    def add(self, chunk):
+        if self.response is None:
+            self.response = {
+                "id": chunk.get("id"),
+                "object": chunk.get("object", "").replace(".chunk", "") or self.completion_type,
+                "created": chunk.get("created", int(time.time())),
+                "model": chunk.get("model")
+            }
+        for choice in chunk.get("choices", []):
+            index = choice.get("index", 0)
+            state = self.choices.setdefault(index, {"role": "assistant", "text": [], "finish_reason": None})
+            if self.completion_type == "chat.completion":
+                delta = choice.get("delta", {})
+                state["role"] = delta.get("role", state["role"])
+                text = delta.get("content")
+            else:
+                text = choice.get("text")
+            if text:
+                state["text"].append(text)
+                if self.on_delta is not None:
+                    self.on_delta(index, text)
+            if choice.get("finish_reason") is not None:
+                state["finish_reason"] = choice["finish_reason"]
+        if chunk.get("usage"):
+            self.response["usage"] = chunk["usage"]
+
+    def result(self):
+        """
+        The assembled response, once the stream has ended
+        """
+        response = dict(self.response or {"object": self.completion_type, "created": int(time.time())})
+        choices = []
+        for index, state in sorted(self.choices.items()):
+            text = "".join(state["text"])
+            if self.completion_type == "chat.completion":
+                choices.append({
+                    "index": index,
+                    "message": {"role": state["role"], "content": text},
+                    "finish_reason": state["finish_reason"]
+                })
+            else:
+                choices.append({"index": index, "text": text, "logprobs": None, "finish_reason": state["finish_reason"]})
+        response["choices"] = choices
+        return response
+
+
+def assemble_stream(completion_type, chunks, on_delta=None):
+    """
+    Consumes a streamed completion, relaying each piece of text to on_delta
+
+    :return: the assembled response
+    """
+    streamed = StreamedResponse(completion_type, on_delta)
+    for chunk in chunks:
+        streamed.add(chunk)
+    return streamed.result()
+
+
+async def assemble_async_stream(completion_type, chunks, on_delta=None):
+    """
+    Consumes an asynchronous streamed completion as assemble_stream does
+    """
+    streamed = StreamedResponse(completion_type, on_delta)
+    async for chunk in chunks:
+        streamed.add(chunk)
+    return streamed.result()
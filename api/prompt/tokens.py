@@ -0,0 +1,127 @@
+"""
+Token counting for triage reports
+"""
+import abc
+import collections
+import functools
+import math
+import re
+import sys
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenCounter(abc.ABC):
+    """
+    The base class for token counters
+
+    Counts are memoised per string, since the same text is usually
+    counted several times over the course of a triage report. The
+    memo is least-recently-used, bounded by the memory of the strings
+    it keeps alive rather than by their number.
+
+    :param max_bytes: the most memory the memoised strings may take
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._counts = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        if not text:
+            return 0
+        with self._lock:
+            tokens = self._counts.get(text)
+            if tokens is not None:
+                self._counts.move_to_end(text)
+                return tokens
+        tokens = self.tokenize_count(text)
+        size = sys.getsizeof(text)
+        if size <= self.max_bytes:
+            with self._lock:
+                if text not in self._counts:
+                    self._counts[text] = tokens
+                    self._size += size
+                while self._size > self.max_bytes:
+                    evicted, _ = self._counts.popitem(last=False)
+                    self._size -= sys.getsizeof(evicted)
+        return tokens
+
+    @abc.abstractmethod
+    def tokenize_count(self, text):
+        """
+        The number of tokens in a non-empty string
+        """
+        pass
+
+
+class BPETokenCounter(TokenCounter):
+    """
+    A fast local approximation of the byte-pair encodings used by
+    OpenAI models
+
+    Text is split with the same pre-tokenization rules as the GPT
+    tokenizers, and each piece is charged the number of tokens a piece
+    of its kind and length typically merges into.
+    """
+
+    pattern = re.compile(r"'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+", re.IGNORECASE)
+
+    def tokenize_count(self, text):
+        tokens = 0
+        for piece in self.pattern.findall(text):
+            word = piece.lstrip(" ")
+            if not word or word.isspace():
+                tokens += 1
+            elif not word.isascii():
+                tokens += math.ceil(len(word.encode("utf-8")) / 3)
+            elif word.isalpha():
+                tokens += 1 if len(word) <= 7 else math.ceil(len(word) / 6)
+            elif word.isdigit() or word.startswith("'"):
+                tokens += 1
+            else:
+                tokens += math.ceil(len(word) / 2)
+        return tokens
+
+
+class TiktokenCounter(TokenCounter):
+    """
+    Exact token counts using the model's own encoding, via tiktoken
+    """
+
+    def __init__(self, model=None, max_bytes=4 * 1024 * 1024):
+        super().__init__(max_bytes)
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def tokenize_count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class WordTokenCounter(TokenCounter):
+    """
+    Counts nltk word tokens rather than model tokens
+    """
+
+    def tokenize_count(self, text):
+        from nltk.tokenize import word_tokenize
+        return len(word_tokenize(text))
+
+
+@functools.lru_cache(maxsize=None)
+def default_token_counter(model=None):
+    """
+    The shared token counter for a model, which is exact when
+    tiktoken is installed and approximate otherwise
+    """
+    if tiktoken is not None:
+        return TiktokenCounter(model)
+    return BPETokenCounter()
@@ -0,0 +1,177 @@
+import array
+import bisect
+import threading
+
+
+class PromptKeys:
+    """
+    Prompt ids in ascending order with the times they were staged
+
+    Ids are assigned as prompts are submitted and times are taken as they
+    finish staging, so times are in id order except where prompts staged
+    at once finish out of order. The latest time up to each id and the
+    earliest time from each id on are kept alongside, and as both are
+    sorted, bisecting them bounds the ids staged in a time range.
+    """
+
+    def __init__(self):
+        self.ids = array.array("q")
+        self.times = array.array("d")
+        self._latest = array.array("d")
+        self._earliest = array.array("d")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, prompt_id, time):
+        i = len(self.ids)
+        if i and prompt_id < self.ids[-1]:
+            i = bisect.bisect_left(self.ids, prompt_id)
+        self.ids.insert(i, prompt_id)
+        self.times.insert(i, time)
+        self._latest.insert(i, max(time, self._latest[i - 1]) if i else time)
+        self._earliest.insert(i, min(time, self._earliest[i]) if i < len(self._earliest) else time)
+        # Only the ids staged out of order around the new one need their bounds moved
+        j = i + 1
+        while j < len(self._latest) and self._latest[j] < time:
+            self._latest[j] = time
+            j += 1
+        j = i - 1
+        while j >= 0 and self._earliest[j] > time:
+            self._earliest[j] = time
+            j -= 1
+
+    def remove(self, prompt_id):
+        """
+        :return: whether the prompt id was present
+        """
+        i = bisect.bisect_left(self.ids, prompt_id)
+        if i == len(self.ids) or self.ids[i] != prompt_id:
+            return False
+        # The bounds either side may be left wider than they need be, which only costs a few extra checks
+        for column in (self.ids, self.times, self._latest, self._earliest):
+            del column[i]
+        return True
+
+    def bounds(self, start=None, end=None):
+        """
+        :return: the range of positions holding every id staged at or after
+        start and before end, which may also hold a few which were not
+        """
+        lo = 0 if start is None else bisect.bisect_left(self._latest, start)
+        hi = len(self.ids) if end is None else bisect.bisect_left(self._earliest, end)
+        return lo, max(lo, hi)
+
+
+class PromptIndex:
+    """
+    In-memory index of the ids of stored prompts
+
+    Writes are applied as deltas (add the new row, drop the deleted
+    one) rather than by reloading the table, so the cost of a write
+    does not grow with the number of stored prompts. Only prompt ids
+    and their times are kept, sorted globally and per u_id, so pages
+    can be found by bisecting on a prompt_id cursor and a time range
+    and their rows read by primary key.
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.RLock()
+        self._keys = PromptKeys()
+        self._users = {}
+        for row in rows:
+            self.add(row)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, prompt_id):
+        ids = self._keys.ids
+        i = bisect.bisect_left(ids, int(prompt_id))
+        return i < len(ids) and ids[i] == int(prompt_id)
+
+    def add(self, row):
+        """
+        Adds a stored prompt to the index
+        """
+        with self._lock:
+            time = row.time.timestamp()
+            self._keys.add(row.prompt_id, time)
+            self._users.setdefault(row.u_id, PromptKeys()).add(row.prompt_id, time)
+
+    def remove(self, row):
+        """
+        Drops a deleted prompt from the index
+        """
+        with self._lock:
+            if self._keys.remove(row.prompt_id):
+                keys = self._users[row.u_id]
+                keys.remove(row.prompt_id)
+                if not keys:
+                    del self._users[row.u_id]
+
+    def has_user(self, u_id):
+        return u_id in self._users
+
+    def user_prompt_ids(self, u_id):
+        """
+        The sorted prompt ids staged by a user
+        """
+        with self._lock:
+            keys = self._users.get(u_id)
+            return list(keys.ids) if keys else []
+
+    def users(self):
+        with self._lock:
+            return list(self._users)
+
+    def max_id(self, default=-1):
+        with self._lock:
+            return self._keys.ids[-1] if self._keys else default
+
+    def page(self, u_id=None, limit=100, after=None, before=None, start=None, end=None):
+        """
+        Keyset pagination over prompt ids
+
+        With no cursor the most recent page is returned. Ids are always
+        returned in ascending order.
+
+        :param u_id: restrict the page to a single user
+        :param limit: maximum number of ids in the page
+        :param after: only return prompts with an id greater than this
+        :param before: only return prompts with an id less than this
+        :param start: only return prompts staged at or after this time
+        :param end: only return prompts staged before this time
+        :return: the prompt ids of the page, and the (previous, next) cursors
+        """
+        with self._lock:
+            keys = self._keys if u_id is None else self._users.get(u_id, PromptKeys())
+            start = None if start is None else start.timestamp()
+            end = None if end is None else end.timestamp()
+            lo, hi = keys.bounds(start, end)
+
+            def in_range(i):
+                return (start is None or keys.times[i] >= start) and (end is None or keys.times[i] < end)
+
+            positions = []
+            if after is not None:
+                i = max(lo, bisect.bisect_right(keys.ids, after))
+                while i < hi and len(positions) < limit:
+                    if in_range(i):
+                        positions.append(i)
+                    i += 1
+            else:
+                i = hi if before is None else min(hi, bisect.bisect_left(keys.ids, before))
+                while i > lo and len(positions) < limit:
+                    i -= 1
+                    if in_range(i):
+                        positions.append(i)
+                positions.reverse()
+
+            previous_cursor = next_cursor = None
+            if positions:
+                if lo < positions[0]:
+                    previous_cursor = keys.ids[positions[0]]
+                if hi > positions[-1] + 1:
+                    next_cursor = keys.ids[positions[-1]]
+            return [keys.ids[i] for i in positions], (previous_cursor, next_cursor)
@@ -1,27 +1,127 @@
-from fastapi import FastAPI
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import threading
+import time
+
+from fastapi import FastAPI, Query, Response
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, select, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, Integer, String, Float, JSON, DateTime
-from starlette.responses import JSONResponse
+from sqlalchemy.orm import defer, sessionmaker
+from sqlalchemy import Column, Integer, String, Float, JSON, DateTime, Text
+from starlette.responses import JSONResponse, StreamingResponse
 
-from api.prompt import Prompt
+from api.compression import Codec, Compressed, CompressedValue, decompressed, is_json
+from api.jobs import JobQueue
+from api.metrics import LatencyHistograms
+from api.payloads import MissingPayload, PayloadStore, encode_payload, upsert_dialects
+from api.prompt import Prompt, completion_default_params, Staging, BasicStaging, AsyncStaging, AsyncBasicStaging, ResponseCache, Blocklist, MockClient, UpstreamScheduler, CostLedger, UnknownModel
+from api.prompt.prompt import stages
+from api.prompt_index import PromptIndex
+from api.rollups import Rollups, resolutions, all_users
+from api.triage_metrics import TriageMetrics
+from api.writer import BatchWriter
 
-db_url = "sqlite:///./pulse.db"
-engine = create_engine(db_url)
+db_url = os.getenv("PULSE_DB_URL", "sqlite:///./pulse.db")
+engine = create_engine(
+    db_url,
+    connect_args={"check_same_thread": False} if db_url.startswith("sqlite") else {},
+    pool_size=int(os.getenv("PULSE_DB_POOL_SIZE", 8)),
+    max_overflow=int(os.getenv("PULSE_DB_MAX_OVERFLOW", 8)),
+    pool_pre_ping=True
+)
 session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# In WAL mode readers do not block the writer. With synchronous=NORMAL a committed
+# transaction survives the process crashing, but the latest commits may be rolled
+# back if the machine loses power; set PULSE_SQLITE_SYNCHRONOUS=FULL to rule that out.
+sqlite_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": os.getenv("PULSE_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": 5000,
+    "cache_size": -65536,
+    "temp_store": "MEMORY"
+}
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+# With PULSE_COMPRESSION set the large text and JSON columns are stored compressed, against the first of
+# the os.pathsep-separated dictionaries in PULSE_COMPRESSION_DICTIONARY if there are any. Existing rows are
+# rewritten to match with python -m api.compact, which also trains dictionaries.
+compress_columns = bool(os.getenv("PULSE_COMPRESSION"))
+compression_dictionaries = []
+for dictionary_path in filter(None, os.getenv("PULSE_COMPRESSION_DICTIONARY", "").split(os.pathsep)):
+    with open(dictionary_path, "rb") as dictionary_file:
+        compression_dictionaries.append(dictionary_file.read())
+codec = Codec(level=int(os.getenv("PULSE_COMPRESSION_LEVEL", 6)), dictionaries=compression_dictionaries)
+
+
+def large_column(column_type, lazy=True):
+    """
+    The type of a large column, compressed if compression is enabled
+    """
+    if not compress_columns:
+        return column_type
+    return Compressed(codec, as_json=isinstance(column_type, JSON), lazy=lazy)
+
+
 Base = declarative_base()
 
+# The columns of a prompt whose values are stored once per distinct value, in the payloads table
+payload_fields = ("prompt", "layering_output", "vaccinated_prompt", "output", "model_parameters")
+
+
+class PayloadModel(Base):
+    __tablename__ = 'payloads'
+    digest = Column(String(64), primary_key=True)
+    content = Column(large_column(Text(), lazy=False), nullable=False)
+    refs = Column(Integer, nullable=False)
+
+
+class RollupModel(Base):
+    __tablename__ = 'rollups'
+    resolution = Column(String(8), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    # Empty for the rollups across all users
+    u_id = Column(String(50), primary_key=True)
+    prompts = Column(Integer, nullable=False)
+    blocked = Column(Integer, nullable=False)
+    rejected = Column(Integer, nullable=False)
+    overhead = Column(Integer, nullable=False)
+    cost = Column(Float, nullable=False)
+    risk_score_sum = Column(Integer, nullable=False)
+    risk_score_1 = Column(Integer, nullable=False)
+    risk_score_2 = Column(Integer, nullable=False)
+    risk_score_3 = Column(Integer, nullable=False)
+    risk_score_4 = Column(Integer, nullable=False)
+    risk_score_5 = Column(Integer, nullable=False)
+    risk_score_6 = Column(Integer, nullable=False)
+    risk_score_7 = Column(Integer, nullable=False)
+    risk_score_8 = Column(Integer, nullable=False)
+    risk_score_9 = Column(Integer, nullable=False)
+    risk_score_10 = Column(Integer, nullable=False)
+
 
 class PromptModel(Base):
     __tablename__ = 'prompts'
     prompt_id = Column(Integer, primary_key=True)
-    u_id = Column(String(50), nullable=False)
+    u_id = Column(String(50), nullable=False, index=True)
     completion_type = Column(String(32), nullable=False)
-    time = Column(DateTime, nullable=False)
-    prompt = Column(String(8192), nullable=False)
+    time = Column(DateTime, nullable=False, index=True)
+    prompt = Column(large_column(String(8192)), nullable=False)
     risk_score = Column(Integer, nullable=False)
     prompt_tokens = Column(Integer, nullable=False)
     vaccinated_prompt_tokens = Column(Integer, nullable=False)
@@ -30,16 +130,38 @@ class PromptModel(Base):
     layering_overhead = Column(Integer, nullable=False)
     layering_to_vaccinated_overhead = Column(Integer, nullable=False)
     gating = Column(String(255), nullable=False)
+    blocklist_version = Column(Integer, nullable=True)
     annotation_verification = Column(String(255), nullable=False)
     layering = Column(String(255), nullable=False)
-    layering_output = Column(String(8192), nullable=False)
+    layering_output = Column(large_column(String(8192)), nullable=False)
     layering_output_tokens = Column(Integer, nullable=False)
     vaccination = Column(String(255), nullable=False)
-    vaccinated_prompt = Column(String(8192), nullable=False)
-    output = Column(JSON, nullable=False)
+    vaccinated_prompt = Column(large_column(String(8192)), nullable=False)
+    output = Column(large_column(JSON()), nullable=False)
     output_tokens = Column(Integer, nullable=False)
     cost = Column(Float, nullable=False)
-    model_parameters = Column(JSON, nullable=False)
+    model_parameters = Column(large_column(JSON()), nullable=False)
+    model = Column(String(64), nullable=True)
+    gating_latency = Column(Float, nullable=True)
+    annotation_verification_latency = Column(Float, nullable=True)
+    layering_latency = Column(Float, nullable=True)
+    vaccination_latency = Column(Float, nullable=True)
+    submit_latency = Column(Float, nullable=True)
+    prompt_digest = Column(String(64), nullable=True)
+    layering_output_digest = Column(String(64), nullable=True)
+    vaccinated_prompt_digest = Column(String(64), nullable=True)
+    output_digest = Column(String(64), nullable=True)
+    model_parameters_digest = Column(String(64), nullable=True)
+
+    def payload(self, field):
+        """
+        The value of a payload column, from the payloads table if the row refers to one
+        """
+        digest = getattr(self, f"{field}_digest")
+        return decompressed(getattr(self, field)) if digest is None else stored_payload(digest)
+
+    def payload_digests(self):
+        return [getattr(self, f"{field}_digest") for field in payload_fields]
 
     def as_dict(self):
         return {
@@ -47,7 +169,7 @@ class PromptModel(Base):
             'prompt_id': self.prompt_id,
             "completion_type": self.completion_type,
             'time': self.time,
-            'prompt': self.prompt,
+            'prompt': self.payload("prompt"),
             'risk_score': self.risk_score,
             'prompt_tokens': self.prompt_tokens,
             'vaccinated_prompt_tokens': self.vaccinated_prompt_tokens,
@@ -56,76 +178,658 @@ class PromptModel(Base):
             'layering_overhead': self.layering_overhead,
             'layering_to_vaccinated_overhead': self.layering_to_vaccinated_overhead,
             'gating': self.gating,
+            'blocklist_version': self.blocklist_version,
             'annotation_verification': self.annotation_verification,
             'layering': self.layering,
-            'layering_output': self.layering_output,
+            'layering_output': self.payload("layering_output"),
             'layering_output_tokens': self.layering_output_tokens,
             'vaccination': self.vaccination,
-            'vaccinated_prompt': self.vaccinated_prompt,
-            'output': self.output,
+            'vaccinated_prompt': self.payload("vaccinated_prompt"),
+            'output': self.payload("output"),
             'output_tokens': self.output_tokens,
             "cost": self.cost,
-            'model_parameters': self.model_parameters
+            'model_parameters': self.payload("model_parameters"),
+            'model': self.model,
+            'gating_latency': self.gating_latency,
+            'annotation_verification_latency': self.annotation_verification_latency,
+            'layering_latency': self.layering_latency,
+            'vaccination_latency': self.vaccination_latency,
+            'submit_latency': self.submit_latency
         }
 
 
+def upgrade_schema(table):
+    """
+    Adds the columns and indexes a table has gained since the database was
+    created, which create_all skips for existing tables
+
+    New columns must be nullable, since existing rows have no value for them.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
 Base.metadata.create_all(bind=engine)
+upgrade_schema(PromptModel.__table__)
 app = FastAPI()
 
+load_batch_size = 1000
+
+
+def stored_rows(sess):
+    """
+    Every stored prompt in prompt_id order, read in batches without its payloads
+    """
+    query = sess.query(PromptModel).options(*[defer(getattr(PromptModel, field)) for field in payload_fields])
+    return query.order_by(PromptModel.prompt_id).yield_per(load_batch_size)
+
+
+def budget(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+# Ids and times of stored prompts, which pages are found from
+prompts = PromptIndex()
+# Columnar metrics of stored prompts, which triage statistics are computed from
+triage_metrics = TriageMetrics()
+# Running costs per user, model and day, with prompts refused staging once the
+# user, the model or the whole API has spent its daily budget, in dollars
+costs = CostLedger(
+    user_budget=budget("PULSE_USER_DAILY_BUDGET"),
+    model_budget=budget("PULSE_MODEL_DAILY_BUDGET"),
+    daily_budget=budget("PULSE_DAILY_BUDGET")
+)
+Staging.cost_ledger = costs
+
 db = session()
-prompts = db.query(PromptModel).all()
+for stored in stored_rows(db):
+    prompts.add(stored)
+    triage_metrics.add(stored)
+    costs.add(stored)
 db.close()
 
-CURRENT_PROMPT_ID = max([-1] + [prompt.prompt_id for prompt in prompts]) + 1
-users = list(set([prompt.u_id for prompt in prompts]))
+CURRENT_PROMPT_ID = prompts.max_id() + 1
 
+# Rows written before payloads were deduplicated keep their values inline, and are read as they are
+deduplicate_payloads = engine.dialect.name in upsert_dialects and os.getenv("PULSE_DEDUPLICATE_PAYLOADS", "1") != "0"
+payloads = PayloadStore(engine, PayloadModel.__table__, int(os.getenv("PULSE_PAYLOAD_CACHE_SIZE", 65536)))
 
-@app.get("/prompts")
-def get_prompts():
-    return {"prompts": [prompt.as_dict() for prompt in prompts]}
 
+def store_payloads(sess, rows):
+    """
+    Stores the payloads of new rows in the same transaction as the rows
+    """
+    payloads.add(sess.connection(), [payload for row in rows for payload in getattr(row, "pending_payloads", ())])
 
-@app.get("/prompts/{prompt_id}")
-def get_prompt(prompt_id):
+
+# Rollups are upserted, so they are kept only on the databases payloads can be deduplicated on
+rollups = Rollups(engine, RollupModel.__table__) if engine.dialect.name in upsert_dialects else None
+if rollups is not None and len(prompts) and rollups.empty():
+    # Prompts stored before rollups were kept are rolled up once
     db = session()
-    prompt = db.query(PromptModel).filter(PromptModel.prompt_id == prompt_id)
+    with engine.begin() as connection:
+        rollups.add(connection, stored_rows(db))
     db.close()
+
+
+def before_insert(sess, rows):
+    """
+    Stores the payloads and rollups of new rows in the same transaction as the rows
+    """
+    store_payloads(sess, rows)
+    if rollups is not None:
+        rollups.add(sess.connection(), rows)
+
+
+writer = BatchWriter(session, before_commit=before_insert)
+
+
+def stored_payload(digest):
+    """
+    The value stored under digest, or None if it is missing, so a row
+    whose payload was lost does not fail a whole page or export
+    """
+    try:
+        return payloads.get(digest)
+    except MissingPayload:
+        return None
+
+
+latencies = LatencyHistograms()
+
+if os.getenv("PULSE_BLOCKLIST_PATH"):
+    BasicStaging.gating_blocklist = Blocklist(path=os.getenv("PULSE_BLOCKLIST_PATH"))
+    BasicStaging.gating_blocklist.watch(float(os.getenv("PULSE_BLOCKLIST_POLL", 5)))
+
+if os.getenv("PULSE_RESPONSE_CACHE"):
+    Staging.response_cache = ResponseCache(
+        max_entries=int(os.getenv("PULSE_RESPONSE_CACHE_SIZE", 4096)),
+        ttl=float(os.getenv("PULSE_RESPONSE_CACHE_TTL", 3600)),
+        max_bytes=int(os.getenv("PULSE_RESPONSE_CACHE_BYTES", 0)) or None,
+        path=os.getenv("PULSE_RESPONSE_CACHE_PATH")
+    )
+
+# Stage against a local, deterministic stand-in for the AI API, for load testing offline
+if os.getenv("PULSE_MODEL_CLIENT") == "mock":
+    Staging.client = MockClient(
+        latency=float(os.getenv("PULSE_MOCK_LATENCY", 0)),
+        distribution=os.getenv("PULSE_MOCK_LATENCY_DISTRIBUTION", "fixed"),
+        error_rate=float(os.getenv("PULSE_MOCK_ERROR_RATE", 0)),
+        seed=int(os.getenv("PULSE_MOCK_SEED", 0))
+    )
+
+# Pace submissions to each model's requests and tokens per minute, retrying transient errors
+if os.getenv("PULSE_RATE_LIMITS"):
+    Staging.scheduler = UpstreamScheduler(
+        burst=float(os.getenv("PULSE_RATE_LIMIT_BURST", 1)),
+        max_retries=int(os.getenv("PULSE_MAX_RETRIES", 6))
+    )
+prompt_id_lock = threading.Lock()
+
+# Staging awaits the upstream model call on the event loop, with at most PULSE_MAX_IN_FLIGHT
+# prompts staging at once. With PULSE_SYNC_STAGING set it blocks on a pool of worker threads instead.
+staging_procedure = BasicStaging if os.getenv("PULSE_SYNC_STAGING") else AsyncBasicStaging
+staging_workers = int(os.getenv("PULSE_STAGING_WORKERS", 8))
+max_in_flight = int(os.getenv("PULSE_MAX_IN_FLIGHT", 1000))
+max_job_wait = 60
+jobs = JobQueue(staging_workers, max_in_flight)
+
+# The number of prompts in a batch which may be awaiting the model at once
+batch_concurrency = int(os.getenv("PULSE_BATCH_CONCURRENCY", 16))
+max_batch_concurrency = 64
+
+
+def next_prompt_id():
+    global CURRENT_PROMPT_ID
+    with prompt_id_lock:
+        prompt_id = CURRENT_PROMPT_ID
+        CURRENT_PROMPT_ID += 1
+    return prompt_id
+
+
+# Prompt options set by the server, which are ignored in request bodies
+server_prompt_options = ("prompt_id", "staging_procedure", "on_delta", "rates", "token_counter")
+
+
+def create_prompt(body, **options):
+    """
+    Creates a prompt with a new id from a request body, with options set by the server
+
+    :raises UnknownModel: if the prompt's model has no rates
+    """
+    fields = {key: value for key, value in body.items() if key not in server_prompt_options}
+    prompt = Prompt(prompt_id=next_prompt_id(), staging_procedure=staging_procedure, **fields, **options)
+    # Prompts for models without rates are refused before they are staged
+    prompt.cost_rates()
+    return prompt
+
+
+max_page_size = 1000
+
+
+def naive_time(value):
+    """
+    Converts an aware datetime to the naive local time prompts are stored in
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def prompt_page(u_id, limit, after, before, start, end):
+    ids, (previous_cursor, next_cursor) = prompts.page(
+        u_id, limit, after=after, before=before, start=naive_time(start), end=naive_time(end)
+    )
+    sess = session()
+    rows = sess.query(PromptModel).filter(PromptModel.prompt_id.in_(ids)).order_by(PromptModel.prompt_id).all()
+    sess.close()
+    payloads.prefetch([digest for row in rows for digest in row.payload_digests()])
+    return {
+        "prompts": [prompt.as_dict() for prompt in rows],
+        "previous": previous_cursor,
+        "next": next_cursor
+    }
+
+
+@app.get("/prompts")
+def get_prompts(
+        limit: int = Query(100, ge=1, le=max_page_size),
+        after: int = None,
+        before: int = None,
+        start: datetime.datetime = None,
+        end: datetime.datetime = None):
+    return prompt_page(None, limit, after, before, start, end)
+
+
+@app.get("/prompts/stats")
+def get_prompt_stats(u_id: str = None, start: datetime.datetime = None, end: datetime.datetime = None):
+    """
+    Aggregate triage statistics across all prompts or those of a single
+    user, optionally only those staged at or after start and before end
+    """
+    if u_id == "all":
+        u_id = None
+    return triage_metrics.stats(u_id, start=naive_time(start), end=naive_time(end))
+
+
+@app.get("/costs")
+def get_costs(day: datetime.date = None):
+    """
+    The cost of the prompts staged on a day, defaulting to today, in
+    total, per user and per model, and the daily budgets they are held to
+    """
+    day = day or datetime.date.today()
+    return {"day": day, **costs.totals(day), "budgets": costs.budgets()}
+
+
+@app.get("/prompts/rollups")
+def get_prompt_rollups(
+        resolution: str = "hour",
+        u_id: str = None,
+        start: datetime.datetime = None,
+        end: datetime.datetime = None):
+    """
+    Per-minute or per-hour totals of triage metrics, across all prompts
+    or those of a single user, in bucket order
+
+    Each bucket has its prompt, blocked and rejected counts, overhead and
+    cost sums, and the number of prompts with each risk score.
+    """
+    if resolution not in resolutions:
+        return JSONResponse({"error": f"Unknown resolution: {resolution}"}, status_code=400)
+    if rollups is None:
+        return JSONResponse({"error": f"Rollups are not kept on {engine.dialect.name} databases"}, status_code=409)
+    if u_id is None or u_id == "all":
+        u_id = all_users
+    return {"rollups": rollups.query(resolution, u_id, start=naive_time(start), end=naive_time(end))}
+
+
+export_batch_size = 1000
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, CompressedValue):
+        return value.decode()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@app.get("/prompts/export")
+def export_prompts(
+        u_id: str = None,
+        start: datetime.datetime = None,
+        end: datetime.datetime = None,
+        fields: str = None):
+    """
+    Streams stored prompts as newline-delimited JSON in prompt_id order
+
+    Rows are read from a server-side cursor as the response is sent,
+    so the history is never held in memory all at once.
+
+    :param fields: comma-separated columns to include, defaulting to all of them
+    """
+    table_columns = PromptModel.__table__.columns
+    exported = [name for name in table_columns.keys() if not name.endswith("_digest")]
+    names = fields.split(",") if fields else exported
+    unknown = [name for name in names if name not in exported]
+    if unknown:
+        return JSONResponse({"error": f"Unknown fields: {', '.join(unknown)}"}, status_code=400)
+    deduplicated = [name for name in names if name in payload_fields]
+
+    query = select(
+        *[table_columns[name] for name in names], *[table_columns[f"{name}_digest"] for name in deduplicated]
+    ).order_by(PromptModel.prompt_id)
+    if u_id is not None:
+        query = query.where(PromptModel.u_id == u_id)
+    if start is not None:
+        query = query.where(PromptModel.time >= naive_time(start))
+    if end is not None:
+        query = query.where(PromptModel.time < naive_time(end))
+
+    def lines():
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=export_batch_size).execute(query)
+            for partition in result.partitions():
+                payloads.prefetch([row._mapping[f"{name}_digest"] for row in partition for name in deduplicated])
+                for row in partition:
+                    values = dict(row._mapping)
+                    for name in deduplicated:
+                        digest = values.pop(f"{name}_digest")
+                        if digest is not None:
+                            values[name] = stored_payload(digest)
+                    yield json.dumps(values, default=json_default) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/prompts/{prompt_id}")
+def get_prompt(prompt_id: int):
+    sess = session()
+    prompt = sess.get(PromptModel, prompt_id)
+    sess.close()
+    if prompt is None:
+        return JSONResponse({"error": "Prompt id not found"}, status_code=404)
     return {"prompt": prompt.as_dict()}
 
 
 @app.get("/prompts/users/{user_id}")
-def get_users_prompts(user_id):
+def get_users_prompts(
+        user_id,
+        limit: int = Query(100, ge=1, le=max_page_size),
+        after: int = None,
+        before: int = None,
+        start: datetime.datetime = None,
+        end: datetime.datetime = None):
     if user_id == "all":
-        return {"prompts": [prompt.as_dict() for prompt in prompts]}
-    elif user_id in users:
-        output_prompts = [prompt.as_dict() for prompt in prompts if prompt.u_id == user_id]
-        return {"prompts": output_prompts}
+        return prompt_page(None, limit, after, before, start, end)
+    elif prompts.has_user(user_id):
+        return prompt_page(user_id, limit, after, before, start, end)
     else:
-        return {"error": "User id not found"}, 404
+        return JSONResponse({"error": "User id not found"}, status_code=404)
+
 
+def prompt_values(report):
+    """
+    The column values of a triage report, coerced to their column types,
+    and the payloads which must be stored with them
 
-@app.post("/prompts")
-def stage_prompt(prompt: dict):
-    global CURRENT_PROMPT_ID, prompts
-    new_prompt = Prompt(prompt_id=CURRENT_PROMPT_ID, **prompt)
-    CURRENT_PROMPT_ID += 1
+    Payload values are replaced by their digests when payloads are deduplicated.
+    """
+    values = {**report, "prompt_id": int(report["prompt_id"]), "cost": float(report["cost"])}
+    pending = []
+    if deduplicate_payloads:
+        for field in payload_fields:
+            digest, content = encode_payload(values[field])
+            payloads.remember(digest, json.loads(content))
+            pending.append((digest, content))
+            values[f"{field}_digest"] = digest
+            # The inline columns are not nullable, so they hold an empty placeholder
+            values[field] = None if is_json(PromptModel.__table__.c[field].type) else ""
+    return values, pending
+
+
+def prompt_row(report):
+    """
+    Creates the row for a triage report, so it can be indexed without
+    a reload, with its payloads left for store_payloads to store alongside it
+    """
+    values, pending = prompt_values(report)
+    row = PromptModel(**values)
+    row.pending_payloads = pending
+    return row
+
+
+def index_stored(reports, rows, write_latency):
+    latencies.record("db_write", write_latency)
+    for report in reports:
+        for stage in stages:
+            latencies.record(stage, report[f"{stage}_latency"])
+    for row in rows:
+        prompts.add(row)
+        triage_metrics.add(row)
+        costs.add(row)
+
+
+def release_costs(reports):
+    """
+    Releases the costs reserved for triage reports which could not be stored
+    """
+    for report in reports:
+        costs.release(report["prompt_id"])
+
+
+def store(reports):
+    """
+    Inserts triage reports, batched with concurrent writes, and indexes them once committed
+    """
+    try:
+        rows = [prompt_row(report) for report in reports]
+        start = time.perf_counter()
+        writer.insert(rows).result()
+    except Exception:
+        release_costs(reports)
+        raise
+    index_stored(reports, rows, time.perf_counter() - start)
+
+
+async def astore(reports):
+    """
+    Stores triage reports as store() does, awaiting the commit on the event loop
+    """
+    try:
+        rows = [prompt_row(report) for report in reports]
+        start = time.perf_counter()
+        await asyncio.wrap_future(writer.insert(rows))
+    except Exception:
+        release_costs(reports)
+        raise
+    index_stored(reports, rows, time.perf_counter() - start)
+
+
+def stage_and_store(new_prompt):
+    """
+    Stages a prompt and stores its triage report
+    """
     new_prompt.stage()
-    if new_prompt["u_id"] not in users:
-        users.append(new_prompt["u_id"])
-    sess = session()
-    sess.add(PromptModel(**new_prompt.dict()))
-    sess.commit()
-    prompts = sess.query(PromptModel).all()
-    sess.close()
+    store([new_prompt.dict()])
+    return new_prompt.dict()
+
+
+async def astage_and_store(new_prompt):
+    """
+    Stages a prompt on the event loop and stores its triage report
+    """
+    await new_prompt.astage()
+    await astore([new_prompt.dict()])
     return new_prompt.dict()
 
 
+@app.on_event("shutdown")
+def flush_writes():
+    writer.close()
+
+
+def submit_staging(new_prompt):
+    """
+    Queues a prompt to be staged and stored as a job
+    """
+    if issubclass(staging_procedure, AsyncStaging):
+        return jobs.submit(astage_and_store, new_prompt, prompt_id=int(new_prompt["prompt_id"]))
+    return jobs.submit(stage_and_store, new_prompt, prompt_id=int(new_prompt["prompt_id"]))
+
+
+@app.post("/prompts", status_code=202)
+async def stage_prompt(prompt: dict, response: Response):
+    try:
+        new_prompt = create_prompt(prompt)
+    except UnknownModel as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    job = submit_staging(new_prompt)
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    return job.dict()
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+
+@app.post("/prompts/stream")
+async def stream_prompt(prompt: dict):
+    """
+    Stages a prompt with its completion streamed back as server-sent events
+
+    A "job" event is sent first, then a "delta" event for each piece of
+    the completion as soon as the model produces it, and finally a
+    "report" event with the stored triage report once the stream has
+    ended, or an "error" event if staging failed.
+    """
+    loop = asyncio.get_running_loop()
+    deltas = asyncio.Queue()
+
+    def on_delta(index, text):
+        # Streamed submissions on worker threads relay their deltas to the event loop
+        loop.call_soon_threadsafe(deltas.put_nowait, {"index": index, "text": text})
+
+    prompt = {**prompt, "model_parameters": {**prompt.get("model_parameters", completion_default_params), "stream": True}}
+    try:
+        new_prompt = create_prompt(prompt, on_delta=on_delta)
+    except UnknownModel as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    start = time.perf_counter()
+    job = submit_staging(new_prompt)
+    job.future.add_done_callback(lambda future: loop.call_soon_threadsafe(deltas.put_nowait, None))
+
+    async def events():
+        yield server_sent_event("job", {"job_id": job.job_id, "prompt_id": int(new_prompt["prompt_id"])})
+        first_token = True
+        while (delta := await deltas.get()) is not None:
+            if first_token:
+                latencies.record("first_token", time.perf_counter() - start)
+                first_token = False
+            yield server_sent_event("delta", delta)
+        if job.status == "complete":
+            yield server_sent_event("report", job.future.result())
+        else:
+            yield server_sent_event("error", {"error": str(job.future.exception())})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Location": f"/jobs/{job.job_id}"}
+    )
+
+
+@app.post("/prompts/batch")
+async def stage_prompt_batch(batch: list[dict], concurrency: int = Query(batch_concurrency, ge=1, le=max_batch_concurrency)):
+    """
+    Stages a batch of prompts concurrently and stores their triage reports together
+
+    Results are returned in the order of the batch, with an error
+    in place of the report for any prompt which failed to stage or
+    could not be stored.
+
+    :param concurrency: the number of prompts which may be staged at once
+    """
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    executor = None
+    if not issubclass(staging_procedure, AsyncStaging):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    async def stage(payload):
+        async with slots:
+            new_prompt = create_prompt({"priority": "batch", **payload})
+            if executor is None:
+                await new_prompt.astage()
+            else:
+                await loop.run_in_executor(executor, new_prompt.stage)
+            return new_prompt.dict()
+
+    try:
+        outcomes = await asyncio.gather(*[stage(payload) for payload in batch], return_exceptions=True)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+    # Each report is stored as its own insert, which the writer still commits
+    # together, so a report which cannot be stored only fails its own item
+    staged = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+    stored = iter(await asyncio.gather(*[astore([report]) for report in staged], return_exceptions=True))
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.append({"status": "failed", "error": str(outcome)})
+            continue
+        error = next(stored)
+        if isinstance(error, Exception):
+            results.append({"status": "failed", "error": f"Staged but could not be stored: {error}"})
+        else:
+            results.append({"status": "complete", "result": outcome})
+    return {"results": results}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id, wait: float = Query(0, ge=0, le=max_job_wait)):
+    """
+    Reports the status of a staging job, and its triage report once complete
+
+    :param wait: seconds to wait for the job to finish before responding
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job id not found"}, status_code=404)
+    if wait:
+        await job.async_wait(wait)
+    return job.dict()
+
+
+@app.get("/latency")
+def get_latency_histograms():
+    """
+    Histograms of the time spent in each stage, in the upstream call
+    (submit), until the first streamed token (first_token) and writing
+    to the database since the API started, in seconds
+    """
+    return latencies.dict()
+
+
+@app.get("/cache")
+def get_cache_stats():
+    if Staging.response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **Staging.response_cache.stats()}
+
+
+@app.get("/scheduler")
+def get_scheduler_stats():
+    """
+    Submissions granted, rate limited, retried and queued per model, and
+    the total seconds they spent waiting for their turn
+    """
+    if Staging.scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, "models": Staging.scheduler.stats()}
+
+
+@app.get("/blocklist")
+def get_blocklist():
+    blocklist = BasicStaging.gating_blocklist
+    return {"version": blocklist.version, "terms": len(blocklist.snapshot()[1]), "path": blocklist.path}
+
+
+@app.post("/blocklist/reload")
+def reload_blocklist():
+    """
+    Reloads the blocklist from its files now rather than at the next poll
+    """
+    blocklist = BasicStaging.gating_blocklist
+    if blocklist.path is None:
+        return JSONResponse({"error": "No blocklist path is configured"}, status_code=409)
+    return {"version": blocklist.load(), "terms": len(blocklist.snapshot()[1])}
+
+
 @app.delete('/prompts/{prompt_id}')
-def delete_prompt(prompt_id):
-    global prompts
+def delete_prompt(prompt_id: int):
     sess = session()
-    sess.query(PromptModel).filter(PromptModel.prompt_id == int(prompt_id)).delete()
+    row = sess.get(PromptModel, prompt_id)
+    if row is not None:
+        digests = row.payload_digests()
+        sess.delete(row)
+        sess.flush()
+        payloads.release(sess.connection(), digests)
+        if rollups is not None:
+            rollups.remove(sess.connection(), [row])
     sess.commit()
-    prompts = sess.query(PromptModel).all()
     sess.close()
+    if row is not None:
+        prompts.remove(row)
+        triage_metrics.remove(prompt_id)
+        costs.remove(row)
     return {'success': True}, 200
@@ -0,0 +1,120 @@
+import collections
+
+from sqlalchemy import select, func
+
+from api.payloads import upsert_dialects
+
+# The start of the bucket a time falls in, by resolution
+resolutions = {
+    "minute": lambda time: time.replace(second=0, microsecond=0),
+    "hour": lambda time: time.replace(minute=0, second=0, microsecond=0)
+}
+# Risk scores are counted in a bucket per score, with scores outside the range counted at its ends
+risk_scores = range(1, 11)
+# The u_id of the rollups across all users
+all_users = ""
+
+counter_columns = ("prompts", "blocked", "rejected", "overhead", "cost", "risk_score_sum") + \
+    tuple(f"risk_score_{score}" for score in risk_scores)
+
+
+def contribution(row):
+    """
+    The amounts a stored prompt adds to the rollups it falls in
+    """
+    risk_score = min(max(row.risk_score, risk_scores[0]), risk_scores[-1])
+    amounts = dict.fromkeys(counter_columns, 0)
+    amounts.update({
+        "prompts": 1,
+        "blocked": int(row.gating.lower().startswith("blocked")),
+        "rejected": int(row.annotation_verification.lower().startswith("error:")),
+        "overhead": row.overhead,
+        "cost": row.cost,
+        "risk_score_sum": row.risk_score,
+        f"risk_score_{risk_score}": 1
+    })
+    return amounts
+
+
+class Rollups:
+    """
+    Per-minute and per-hour totals of triage metrics, across all users
+    and per u_id, maintained as prompts are inserted and deleted
+
+    Each batch of rows is summed per bucket in memory and applied as one
+    upsert which adds to the stored totals, so a dashboard over weeks of
+    traffic reads a few hundred rollups rather than every prompt.
+
+    :param table: the rollup table, keyed by resolution, bucket and u_id, with a column per counter
+    """
+
+    def __init__(self, engine, table):
+        self.engine = engine
+        self.table = table
+
+    def _apply(self, connection, rows, sign):
+        totals = collections.defaultdict(collections.Counter)
+        for row in rows:
+            amounts = contribution(row)
+            for resolution, truncate in resolutions.items():
+                bucket = truncate(row.time)
+                for u_id in (all_users, row.u_id):
+                    totals[(resolution, bucket, u_id)].update(amounts)
+        if not totals:
+            return
+        insert = upsert_dialects[self.engine.dialect.name](self.table)
+        connection.execute(
+            insert.on_conflict_do_update(
+                index_elements=[self.table.c.resolution, self.table.c.bucket, self.table.c.u_id],
+                set_={column: self.table.c[column] + insert.excluded[column] for column in counter_columns}
+            ),
+            [
+                {
+                    "resolution": resolution, "bucket": bucket, "u_id": u_id,
+                    **{column: sign * amounts[column] for column in counter_columns}
+                }
+                for (resolution, bucket, u_id), amounts in totals.items()
+            ]
+        )
+
+    def add(self, connection, rows):
+        """
+        Adds stored prompts to their rollups within a transaction
+        """
+        self._apply(connection, rows, 1)
+
+    def remove(self, connection, rows):
+        """
+        Takes deleted prompts out of their rollups within a transaction
+        """
+        self._apply(connection, rows, -1)
+
+    def empty(self):
+        with self.engine.connect() as connection:
+            return not connection.execute(select(func.count()).select_from(self.table)).scalar()
+
+    def query(self, resolution, u_id=all_users, start=None, end=None):
+        """
+        The rollups of a resolution in bucket order, for buckets starting
+        at or after start and before end
+        """
+        query = select(self.table).where(self.table.c.resolution == resolution, self.table.c.u_id == u_id)
+        if start is not None:
+            query = query.where(self.table.c.bucket >= start)
+        if end is not None:
+            query = query.where(self.table.c.bucket < end)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query.order_by(self.table.c.bucket)).all()
+        return [
+            {
+                "bucket": row.bucket,
+                "prompts": row.prompts,
+                "blocked": row.blocked,
+                "rejected": row.rejected,
+                "overhead": row.overhead,
+                "cost": row.cost,
+                "average_risk_score": row.risk_score_sum / row.prompts if row.prompts else 0,
+                "risk_scores": {score: row._mapping[f"risk_score_{score}"] for score in risk_scores}
+            }
+            for row in rows if row.prompts
+        ]
@@ -0,0 +1,204 @@
+import array
+import bisect
+import collections
+import itertools
+import operator
+import threading
+
+from api.rollups import risk_scores
+
+# The numeric metrics of a triage report, by array typecode
+numeric_fields = {
+    "risk_score": "q",
+    "prompt_tokens": "q",
+    "vaccinated_prompt_tokens": "q",
+    "overhead": "q",
+    "layering_input_tokens": "q",
+    "layering_overhead": "q",
+    "layering_to_vaccinated_overhead": "q",
+    "layering_output_tokens": "q",
+    "output_tokens": "q",
+    "cost": "d"
+}
+categorical_fields = ("u_id", "completion_type", "gating", "annotation_verification", "layering", "vaccination")
+
+
+class Categories:
+    """
+    Dictionary encoding of a categorical field, so each row holds a small integer code in place of its value
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def matching(self, predicate):
+        """
+        The codes of the values for which predicate is true
+        """
+        return [code for code, value in enumerate(self.values) if predicate(value)]
+
+
+def gather(column, positions):
+    """
+    The values of a column at positions
+    """
+    if len(positions) == 1:
+        return [column[positions[0]]]
+    return operator.itemgetter(*positions)(column) if positions else ()
+
+
+class TriageMetrics:
+    """
+    Columnar store of the numeric and categorical metrics of stored
+    prompts, which triage statistics are computed from
+
+    Each field is a typed array, with categorical fields dictionary
+    encoded, so a row costs around a hundred bytes rather than a whole
+    ORM object. Rows are appended in the order they are stored and
+    deleted rows are only marked until enough of them have built up to
+    compact, so row positions are stable and each user's rows are kept
+    as a list of positions. As with PromptKeys, the latest time up to
+    each row and the earliest from each row on are kept alongside, so a
+    time range is found by bisection and a query only reads the rows it
+    selects.
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.RLock()
+        self._categories = {field: Categories() for field in categorical_fields}
+        self._reset()
+        for row in rows:
+            self.add(row)
+
+    def _reset(self):
+        self._ids = array.array("q")
+        self._times = array.array("d")
+        self._latest = array.array("d")
+        self._earliest = array.array("d")
+        self._live = bytearray()
+        self._deleted = 0
+        self._numeric = {field: array.array(typecode) for field, typecode in numeric_fields.items()}
+        self._codes = {field: array.array("i") for field in categorical_fields}
+        self._users = {}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._ids) - self._deleted
+
+    def _append(self, prompt_id, time, numeric, codes):
+        position = len(self._ids)
+        self._positions[prompt_id] = position
+        self._ids.append(prompt_id)
+        self._times.append(time)
+        self._latest.append(max(time, self._latest[-1]) if position else time)
+        self._earliest.append(time)
+        # Only the rows stored out of time order before this one need their bounds moved
+        i = position - 1
+        while i >= 0 and self._earliest[i] > time:
+            self._earliest[i] = time
+            i -= 1
+        self._live.append(1)
+        for field, value in zip(self._numeric, numeric):
+            self._numeric[field].append(value)
+        for field, code in zip(self._codes, codes):
+            self._codes[field].append(code)
+        self._users.setdefault(self._codes["u_id"][-1], array.array("q")).append(position)
+
+    def add(self, row):
+        """
+        Adds the metrics of a stored prompt
+        """
+        with self._lock:
+            self._append(
+                row.prompt_id,
+                row.time.timestamp(),
+                [getattr(row, field) for field in numeric_fields],
+                [self._categories[field].encode(getattr(row, field)) for field in categorical_fields]
+            )
+
+    def remove(self, prompt_id):
+        with self._lock:
+            position = self._positions.pop(int(prompt_id), None)
+            if position is not None:
+                self._live[position] = 0
+                self._deleted += 1
+                if self._deleted > len(self._ids) // 2:
+                    self._compact()
+
+    def _compact(self):
+        """
+        Rewrites the columns without the deleted rows
+        """
+        live = self._live
+        columns = [self._ids, self._times, *self._numeric.values(), *self._codes.values()]
+        kept = [array.array(column.typecode, itertools.compress(column, live)) for column in columns]
+        self._reset()
+        numeric_count = len(numeric_fields)
+        for values in zip(*kept):
+            self._append(values[0], values[1], values[2:2 + numeric_count], values[2 + numeric_count:])
+
+    def _selection(self, u_id, start, end):
+        """
+        The positions of the rows matching the filters, or None for every row
+        """
+        if u_id is None and start is None and end is None:
+            return None
+        start = None if start is None else start.timestamp()
+        end = None if end is None else end.timestamp()
+        lo = 0 if start is None else bisect.bisect_left(self._latest, start)
+        hi = len(self._ids) if end is None else bisect.bisect_left(self._earliest, end)
+        if u_id is None:
+            candidates = range(lo, hi)
+        else:
+            positions = self._users.get(self._categories["u_id"].codes.get(u_id), ())
+            candidates = positions[bisect.bisect_left(positions, lo):bisect.bisect_left(positions, hi)]
+        live, times = self._live, self._times
+        return [
+            i for i in candidates
+            if live[i] and (start is None or times[i] >= start) and (end is None or times[i] < end)
+        ]
+
+    def _column(self, column, selection):
+        if selection is not None:
+            return gather(column, selection)
+        return itertools.compress(column, self._live) if self._deleted else column
+
+    def _count(self, field, predicate, selection):
+        counts = collections.Counter(self._column(self._codes[field], selection))
+        return sum(counts[code] for code in self._categories[field].matching(predicate))
+
+    def stats(self, u_id=None, start=None, end=None):
+        """
+        Aggregate triage statistics across all prompts, or those of one
+        user or staged at or after start and before end, with the number
+        of prompts at each risk score
+        """
+        with self._lock:
+            selection = self._selection(u_id, start, end)
+            count = len(self) if selection is None else len(selection)
+            total_overhead = sum(self._column(self._numeric["overhead"], selection))
+            risk_score_counts = collections.Counter(self._column(self._numeric["risk_score"], selection))
+            total_risk_score = sum(score * prompts for score, prompts in risk_score_counts.items())
+            # Scores outside the range are counted at its ends, as in the rollups
+            histogram = dict.fromkeys(risk_scores, 0)
+            for score, prompts in risk_score_counts.items():
+                histogram[min(max(score, risk_scores[0]), risk_scores[-1])] += prompts
+            return {
+                "prompts": count,
+                "gated": self._count("gating", lambda gating: gating.lower().startswith("blocked"), selection),
+                "annotations_verified": self._count("annotation_verification", "Pass".__eq__, selection),
+                "staged": self._count("vaccination", "Cancelled".__ne__, selection),
+                "total_overhead": total_overhead,
+                "average_overhead": total_overhead / count if count else 0,
+                "average_risk_score": total_risk_score / count if count else 0,
+                "risk_scores": histogram,
+                "total_cost": sum(self._column(self._numeric["cost"], selection))
+            }
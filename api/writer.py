@@ -0,0 +1,91 @@
+import concurrent.futures
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    """
+    Write-behind writer which coalesces inserts from many callers
+    into shared transactions
+
+    Inserts are queued to a single writer thread, which commits
+    whatever has accumulated (up to max_batch rows, waiting at most
+    max_delay seconds for more) as one transaction. The future returned
+    by insert() resolves only once its rows are committed, so a caller
+    which waits on it has the same guarantee as committing itself.
+
+    :param before_commit: called with the session and rows of each transaction before they are added to it
+    """
+
+    def __init__(self, session_factory, max_batch=500, max_delay=0.002, before_commit=None):
+        self.session_factory = session_factory
+        self.before_commit = before_commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="pulse-writer", daemon=True)
+        self._thread.start()
+
+    def insert(self, rows):
+        """
+        Queues rows to be inserted
+
+        :return: a Future which resolves once the rows are committed
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((list(rows), future))
+        return future
+
+    def close(self):
+        """
+        Commits everything queued so far and stops the writer thread
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            count = len(item[0])
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while count < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                count += len(item[0])
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        sess = self.session_factory(expire_on_commit=False)
+        try:
+            rows = [row for rows, _ in batch for row in rows]
+            if self.before_commit is not None:
+                self.before_commit(sess, rows)
+            sess.add_all(rows)
+            sess.commit()
+        except Exception as e:
+            sess.rollback()
+            if len(batch) > 1:
+                # Retry each caller's rows on their own so one bad insert only fails its own caller
+                for item in batch:
+                    self._commit([item])
+            else:
+                batch[0][1].set_exception(e)
+            return
+        finally:
+            sess.close()
+        for _, future in batch:
+            future.set_result(None)
@@ -9,24 +9,28 @@ class AnalyticsTab(ttk.Notebook):
     The AnalyticsTab is a tabbed interface containing filtered
     data based on the current prompt set
     """
-    def __init__(self, master, option_var, selection, prompts):
+    def __init__(self, master, option_var, selection, prompts, stats):
         ttk.Notebook.__init__(self, master=master)
         plt.close("all")
 
-        # Refresh current prompts
-        l_p = len(prompts)
+        # Overhead of the loaded prompts, and risk scores across every prompt
         overhead_counts = [prompt["overhead"] for prompt in prompts]
-        risk_score_counts = [prompt["risk_score"] for prompt in prompts]
+        risk_scores = [int(score) for score in stats["risk_scores"]]
+        risk_score_counts = list(stats["risk_scores"].values())
+        source = "u_id " + option_var if option_var != "all" else "all users"
 
         # Overview
         self.overview_frame = ttk.Frame(self)
 
-        text = f"Gated: {l_p - sum([1 for prompt in prompts if not prompt['gating'].lower().startswith('blocked')])}/{l_p}\n\n"
-        text += f"Annotations verified: {sum([1 for prompt in prompts if prompt['annotation_verification'] == 'Pass'])}/{l_p}\n\n"
-        text += f"Total overhead: {sum([prompt['overhead'] for prompt in prompts])}\n\n"
-        text += f"Total staged: {sum([1 for prompt in prompts if prompt['vaccination'] != 'Cancelled'])}"
+        text = f"All prompts from {source}\n\n"
+        text += f"Gated: {stats['gated']}/{stats['prompts']}\n\n"
+        text += f"Annotations verified: {stats['annotations_verified']}/{stats['prompts']}\n\n"
+        text += f"Total overhead: {stats['total_overhead']}\n\n"
+        text += f"Total staged: {stats['staged']}\n\n"
+        text += f"Average overhead: {stats['average_overhead']:.2f}\n\n"
+        text += f"Average risk score: {stats['average_risk_score']:.2f}"
 
-        self.overview_text = tk.Text(self.overview_frame, height=10, width=35, borderwidth=0, highlightthickness=0)
+        self.overview_text = tk.Text(self.overview_frame, height=14, width=35, borderwidth=0, highlightthickness=0)
         self.overview_text.insert("1.0", text)
         self.overview_text.config(state="disabled", bg="#f0f0f0")
         self.overview_text.place(x=0, y=20)
@@ -42,7 +46,7 @@ class AnalyticsTab(ttk.Notebook):
         ax.bar([i for i in range(1, len(prompts) + 1)], overhead_counts, color=bar_colors)
         ax.set_ylabel("Overhead")
         ax.set_xlabel("Prompt")
-        ax.set_title(f"Overhead of last {len(prompts)} prompts from {'u_id ' + option_var if option_var != 'all' else 'all users'}")
+        ax.set_title(f"Overhead of the {len(prompts)} most recent prompts from {source}")
         self.overhead_graph_figure = FigureCanvasTkAgg(self.overhead_graph, master=self.overhead_frame)
         self.overhead_graph_figure.get_tk_widget().pack(expand=True, fill="both")
         plt.axhline(y=avg, color="black")
@@ -51,16 +55,16 @@ class AnalyticsTab(ttk.Notebook):
         self.risk_score_frame = ttk.Frame(self)
         self.risk_score_graph, bx = plt.subplots()
         bar_colors = [
-            "green" if crsc < 3 else "yellow" if crsc < 5 else "orange" if crsc < 8 else "red" for crsc in risk_score_counts
+            "green" if score < 3 else "yellow" if score < 5 else "orange" if score < 8 else "red" for score in risk_scores
         ]
 
-        bx.bar([i for i in range(1, len(prompts) + 1)], risk_score_counts, color=bar_colors)
-        bx.set_ylabel("Risk Score")
-        bx.set_xlabel("Prompt")
-        bx.set_title(f"Risk score of last {len(prompts)} prompts from {'u_id ' + option_var if option_var != 'all' else 'all users'}")
+        bx.bar(risk_scores, risk_score_counts, color=bar_colors)
+        bx.set_ylabel("Prompts")
+        bx.set_xlabel("Risk Score")
+        bx.set_title(f"Risk scores of all {stats['prompts']} prompts from {source}")
         self.risk_score_graph_figure = FigureCanvasTkAgg(self.risk_score_graph, master=self.risk_score_frame)
         self.risk_score_graph_figure.get_tk_widget().pack(expand=True, fill="both")
-        plt.axhline(y=sum(risk_score_counts) / max(1, len(risk_score_counts)))
+        plt.axvline(x=stats["average_risk_score"], color="black")
 
         # Add tabs and grid
         self.add(self.overview_frame, text="Overview")
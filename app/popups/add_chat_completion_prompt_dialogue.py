@@ -28,7 +28,7 @@ class AddChatCompletionPromptDialogue(tk.Toplevel):
         self.action = action
         self.logit_bias_dialogue = None
         model_params = prompt.get("model_parameters", chat_completion_default_params)
-        self.previous_messages = model_params.get("messages", [])
+        self.previous_messages = list(model_params.get("messages", []))
 
         self.system_message_label = tk.Label(self, text="System message:")
         self.system_message_label.grid(row=0, column=0)
@@ -4,7 +4,7 @@ from tkinter import messagebox
 
 from app import *
 from api.prompt import Prompt
-from api import pulse_api_url, pulse_user_api_url
+from api import pulse_api_url, pulse_user_api_url, pulse_stats_api_url, pulse_jobs_url, page_size
 
 
 class Pulse(tk.Tk):
@@ -16,6 +16,8 @@ class Pulse(tk.Tk):
     def __init__(self, master=None, prompts=None):
         tk.Tk.__init__(self, master)
         self.prompts: list[Prompt] = prompts or []
+        # The cursor of the prompts before the oldest one loaded, if there are any
+        self.previous_cursor = None
 
         self.config(padx=5, pady=5)
         self.title("Pulse - PromptOps by Complexor")
@@ -30,6 +32,10 @@ class Pulse(tk.Tk):
         self.prompt_listbox = PromptListbox(self, self.on_prompt_select, self.show_prompt_viewer, self.scrollbar)
         self.prompt_listbox.grid(row=1, column=0, columnspan=2)
 
+        # Load older prompts button
+        self.load_older_button = tk.Button(self, text="Load Older Prompts", command=self.load_older_prompts)
+        self.load_older_button.grid(row=2, column=0, columnspan=2)
+
         # Add prompt button
         self.add_prompt_button = tk.Button(self, text="Add Prompt", command=self.add_prompt)
         self.add_prompt_button.grid(row=0, column=0)
@@ -81,8 +87,12 @@ class Pulse(tk.Tk):
         def invoke_add_prompt(new_prompt_data):
             self.add_completion_prompt_dialogue and self.add_completion_prompt_dialogue.destroy()
             self.add_chat_completion_prompt_dialogue and self.add_chat_completion_prompt_dialogue.destroy()
-            new_prompt = requests.post(pulse_api_url, json=new_prompt_data)
-            new_prompt = Prompt(**new_prompt.json())
+            job = requests.post(pulse_api_url, json=new_prompt_data).json()
+            job = requests.get(pulse_jobs_url + job["job_id"], params={"wait": 60}).json()
+            if job["status"] != "complete":
+                messagebox.showerror("Staging failed", job.get("error", f"Staging job is still {job['status']}"))
+                return
+            new_prompt = Prompt(**job["result"])
             self.update_components()
             self.prompt_listbox.selection_set(len(self.prompts) - 1)
             self.triage_panel.set_prompt_info(new_prompt)
@@ -141,6 +151,20 @@ class Pulse(tk.Tk):
         self.u_id_dropdown_menu = tk.OptionMenu(self, self.dropdown_var, *self.u_id_list)
         self.u_id_dropdown_menu.grid(row=0, column=2)
 
+    def load_older_prompts(self):
+        """
+        Loads the page of prompts before the oldest one in the listbox
+        """
+        if self.previous_cursor is None:
+            return
+        params = {"limit": page_size, "before": self.previous_cursor}
+        page = requests.get(pulse_user_api_url + self.dropdown_var.get(), params=params).json()
+        self.prompts = [Prompt(**data) for data in page["prompts"]] + self.prompts
+        self.previous_cursor = page["previous"]
+        self.load_older_button.config(state="normal" if self.previous_cursor is not None else "disabled")
+        self.triage_panel.clear_prompt_info()
+        self.prompt_listbox.update_prompts(self.prompts)
+
     def on_prompt_select(self, event):
         """
         Update the currently-displayed prompt staging summary
@@ -166,10 +190,14 @@ class Pulse(tk.Tk):
         Updates the analytics tab
         """
         option_var = self.dropdown_var.get()
-        self.prompts = [Prompt(**data) for data in requests.get(pulse_user_api_url + option_var).json()["prompts"]]
+        page = requests.get(pulse_user_api_url + option_var, params={"limit": page_size}).json()
+        self.prompts = [Prompt(**data) for data in page["prompts"]]
+        self.previous_cursor = page["previous"]
+        self.load_older_button.config(state="normal" if self.previous_cursor is not None else "disabled")
+        stats = requests.get(pulse_stats_api_url, params={"u_id": option_var}).json()
 
         if self.analytics_tab:
             selection = int(self.analytics_tab.index("current"))
         else:
             selection = 0
-        self.analytics_tab = AnalyticsTab(self, option_var, selection, self.prompts)
+        self.analytics_tab = AnalyticsTab(self, option_var, selection, self.prompts, stats)
@@ -0,0 +1,3 @@
+"""
+Reproducible benchmarks of staging, triage reports and the API
+"""
@@ -0,0 +1,58 @@
+"""
+Runs the benchmark suite, or compares two saved runs
+
+    python -m bench [--rows 1000,100000,1000000] [--only staging|storage] [--output bench_output.json]
+    python -m bench compare base.json head.json [--threshold 0.1]
+
+The suite runs against the mock model and a scratch SQLite database,
+so it needs neither network access nor an existing pulse.db.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Pulse benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    compare_parser = subparsers.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative slowdown reported as a regression (default 0.1)")
+    parser.add_argument("--rows", default="1000,100000,1000000", help="comma-separated table sizes for the storage benchmarks")
+    parser.add_argument("--only", choices=("staging", "storage"), help="run one group of benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per repeat")
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args()
+
+    from bench.harness import Results, compare
+
+    if args.command == "compare":
+        regressions = compare(args.base, args.head, args.threshold)
+        print(f"\n{len(regressions)} regression(s)")
+        return 1 if regressions else 0
+
+    # Set before the API is first imported, since it connects on import
+    scratch = tempfile.mkdtemp(prefix="pulse-bench-")
+    os.environ["PULSE_DB_URL"] = f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ["PULSE_MODEL_CLIENT"] = "mock"
+
+    results = Results(repeat=args.repeat, min_time=args.min_time)
+    sizes = [int(size) for size in args.rows.split(",") if size]
+    results.meta["rows"] = sizes
+    if args.only in (None, "staging"):
+        from bench import staging
+        staging.run(results)
+    if args.only in (None, "storage"):
+        from bench import storage
+        storage.run(results, sizes)
+    results.save(args.output)
+    print(f"\nSaved {len(results.benchmarks)} results to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
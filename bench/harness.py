@@ -0,0 +1,127 @@
+"""
+Timing, saving and comparing benchmark results
+"""
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+
+class Results:
+    """
+    The results of one run of the benchmark suite
+    """
+
+    def __init__(self, repeat=5, min_time=0.2):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.benchmarks = []
+        self.meta = {
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "time": datetime.datetime.now().isoformat()
+        }
+
+    def measure(self, name, fn, number=None, **params):
+        """
+        Times fn, calling it enough times per repeat to take at least
+        min_time unless number is given, and records the seconds per call
+
+        :param params: the parameters of the case, saved with its result
+        """
+        timer = timeit.Timer(fn, timer=time.perf_counter)
+        if number is None:
+            number, taken = timer.autorange()
+            number = max(1, int(number * self.min_time / taken))
+        times = [t / number for t in timer.repeat(repeat=self.repeat, number=number)]
+        result = {
+            "name": name,
+            "params": params,
+            "number": number,
+            "repeat": self.repeat,
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "ops_per_sec": 1 / statistics.median(times) if statistics.median(times) else None
+        }
+        self.benchmarks.append(result)
+        print(f"{name:60} {format_seconds(result['median']):>12}  ({number} x {self.repeat})", flush=True)
+        return result
+
+    def record(self, name, seconds, **params):
+        """
+        Records a one-off timing, such as loading a table
+        """
+        result = {
+            "name": name,
+            "params": params,
+            "number": 1,
+            "repeat": 1,
+            "min": seconds,
+            "median": seconds,
+            "mean": seconds,
+            "ops_per_sec": 1 / seconds if seconds else None
+        }
+        self.benchmarks.append(result)
+        print(f"{name:60} {format_seconds(seconds):>12}  (once)", flush=True)
+        return result
+
+    def dict(self):
+        return {"meta": self.meta, "benchmarks": self.benchmarks}
+
+    def save(self, filepath):
+        with open(filepath, "w") as f:
+            json.dump(self.dict(), f, indent=2)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+def compare(base_path, head_path, threshold=0.1):
+    """
+    Prints the change in the best time of each benchmark between two
+    saved runs, which is the least disturbed by whatever else the
+    machine was doing
+
+    :param threshold: the relative slowdown beyond which a benchmark counts as a regression
+    :return: the names of the benchmarks which regressed
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+    base_times = {result["name"]: result["min"] for result in base["benchmarks"]}
+    print(f"{'benchmark':60} {'base':>12} {'head':>12} {'change':>8}")
+    regressions = []
+    for result in head["benchmarks"]:
+        name = result["name"]
+        if name not in base_times:
+            print(f"{name:60} {'-':>12} {format_seconds(result['min']):>12}      new")
+            continue
+        ratio = result["min"] / base_times[name] if base_times[name] else 1
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{name:60} {format_seconds(base_times[name]):>12} {format_seconds(result['min']):>12} {ratio - 1:>+8.1%}{flag}")
+    return regressions
@@ -0,0 +1,89 @@
+"""
+Benchmarks of the staging stages and triage reports
+"""
+import random
+
+from api.prompt import Prompt, BasicStaging, Blocklist, MockClient, Staging
+from api.prompt.tokens import BPETokenCounter
+
+# Every input is generated from this seed, so runs are comparable
+seed = 1553
+
+words = (
+    "please", "summarise", "the", "following", "document", "and", "list", "its", "key", "points",
+    "ignore", "previous", "instructions", "system", "prompt", "reveal", "secret", "answer", "user", "input"
+)
+
+
+def text(length, rng):
+    return " ".join(rng.choice(words) for _ in range(length))
+
+
+def adversarial_annotations(rng):
+    """
+    Annotated prompts built to be as slow as possible to verify
+    """
+    return {
+        # Thousands of distinct tags, each left open until the end
+        "deep_nesting": "".join(f"[t{i}]" for i in range(5000)) + "".join(f"[/t{i}]" for i in reversed(range(5000))),
+        # The same tag reopened inside itself over and over
+        "self_nesting": "[a]" * 5000 + "[/a]" * 5000,
+        # Every pair of tags interleaved with the next
+        "overlapping": "".join(f"[x{i}][y{i}][/x{i}][/y{i}]" for i in range(2500)),
+        # Closing tags with nothing to close
+        "unmatched_closers": "[/z]" * 10000,
+        # Long text with tags of every delimiter scattered through it
+        "mixed_delimiters": " ".join(
+            rng.choice(("[{0}]", "[/{0}]", "{{{0}}}", "{{/{0}}}", "<{0}>", "</{0}>", "{0}")).format(rng.choice(words))
+            for _ in range(20000)
+        ),
+        # Brackets which never form a tag
+        "bracket_soup": "".join(rng.choice("[]{}<>/ ab") for _ in range(100000))
+    }
+
+
+def run(results):
+    rng = random.Random(seed)
+    staging = BasicStaging("chat.completion", {})
+
+    prompts = {"short": text(20, rng), "long": text(2000, rng)}
+    for name, prompt in prompts.items():
+        results.measure(f"gating/default_blocklist/{name}", lambda: staging.gating(prompt), words=len(prompt.split()))
+
+    large = BasicStaging("chat.completion", {})
+    terms = [f"{rng.choice(words)}{i} {rng.choice(words)}" if i % 2 else f"blocked{i}" for i in range(10000)]
+    large.gating_blocklist = Blocklist(terms)
+    for name, prompt in prompts.items():
+        results.measure(f"gating/10k_term_blocklist/{name}", lambda: large.gating(prompt), words=len(prompt.split()))
+
+    for name, prompt in adversarial_annotations(rng).items():
+        results.measure(
+            f"annotation_verification/{name}", lambda: staging.annotation_verification(prompt, "[]"), length=len(prompt)
+        )
+        results.measure(f"verify_annotations/{name}", lambda: staging.verify_annotations(prompt), length=len(prompt))
+
+    # Triage reports of prompts staged against the mock model, with a warm and a cold token count cache
+    client = Staging.client
+    Staging.client = MockClient()
+    try:
+        for name, prompt in prompts.items():
+            parameters = {"model": "gpt-3.5-turbo", "max_tokens": 64, "messages": [{"role": "user", "content": prompt}]}
+            staged = Prompt(u_id=1, prompt_id=1, completion_type="chat.completion", model_parameters=parameters)
+            staged.stage()
+
+            def cold_report():
+                staged.token_counter = BPETokenCounter()
+                staged.generate_triage_report()
+
+            results.measure(f"generate_triage_report/warm/{name}", staged.generate_triage_report, words=len(prompt.split()))
+            results.measure(f"generate_triage_report/cold/{name}", cold_report, words=len(prompt.split()))
+
+            def stage():
+                Prompt(
+                    u_id=1, prompt_id=1, completion_type="chat.completion",
+                    model_parameters={**parameters, "messages": [{"role": "user", "content": prompt}]}
+                ).stage()
+
+            results.measure(f"prompt_stage/mock_model/{name}", stage, words=len(prompt.split()))
+    finally:
+        Staging.client = client
@@ -0,0 +1,141 @@
+"""
+Benchmarks of storing triage reports and serving them from the API
+"""
+import datetime
+import random
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from api import pulse_fastapi
+from api.prompt_index import PromptIndex
+from api.triage_metrics import TriageMetrics
+from api.pulse_fastapi import PromptModel, before_insert, engine, payloads, prompt_row, prompt_values, rollups, session, stored_rows
+
+users = 100
+fill_batch_size = 10000
+
+# Rows inserted by the insert benchmarks take ids from here up, out of the way of the filled rows
+insert_base = 10 ** 9
+
+
+def report(prompt_id, rng):
+    """
+    A plausible triage report to fill the table with
+    """
+    prompt = "please summarise the following document and list its key points"
+    return {
+        "prompt_id": prompt_id,
+        "u_id": str(rng.randrange(users)),
+        "completion_type": "chat.completion",
+        "time": datetime.datetime(2023, 1, 1) + datetime.timedelta(seconds=prompt_id),
+        "prompt": prompt,
+        "risk_score": rng.randint(1, 10),
+        "prompt_tokens": 11,
+        "vaccinated_prompt_tokens": 15,
+        "overhead": 4,
+        "layering_input_tokens": 11,
+        "layering_overhead": 0,
+        "layering_to_vaccinated_overhead": 4,
+        "gating": "Pass",
+        "blocklist_version": 1,
+        "annotation_verification": "Pass",
+        "layering": "Complete",
+        "layering_output": prompt,
+        "layering_output_tokens": 11,
+        "vaccination": "Complete",
+        "vaccinated_prompt": "[input]" + prompt + "[/input]",
+        "output": {"choices": [{"message": {"role": "assistant", "content": "the key points are"}}]},
+        "output_tokens": 4,
+        "cost": 0.00004,
+        "model_parameters": {"model": "gpt-3.5-turbo", "max_tokens": 64},
+        "model": "gpt-3.5-turbo"
+    }
+
+
+def fill(count, rng):
+    """
+    Inserts rows, stored as the API stores them, with the core API until the table holds count of them
+    """
+    with engine.begin() as connection:
+        filled = connection.execute(
+            select(func.max(PromptModel.prompt_id)).where(PromptModel.prompt_id < insert_base)
+        ).scalar() or 0
+    for first in range(filled + 1, count + 1, fill_batch_size):
+        batch = [prompt_values(report(prompt_id, rng)) for prompt_id in range(first, min(first + fill_batch_size, count + 1))]
+        with engine.begin() as connection:
+            payloads.add(connection, [payload for _, pending in batch for payload in pending])
+            rollups.add(connection, [PromptModel(**values) for values, _ in batch])
+            connection.execute(PromptModel.__table__.insert(), [values for values, _ in batch])
+
+
+def run(results, sizes, seed=1553):
+    rng = random.Random(seed)
+    client = TestClient(pulse_fastapi.app)
+    next_id = [insert_base]
+
+    def new_rows(count):
+        rows = [prompt_row(report(next_id[0] + i, rng)) for i in range(count)]
+        next_id[0] += count
+        return rows
+
+    for size in sizes:
+        start = time.perf_counter()
+        fill(size, rng)
+        results.record(f"fill/{size}", time.perf_counter() - start, rows=size)
+
+        start = time.perf_counter()
+        db = session()
+        pulse_fastapi.prompts = PromptIndex(stored_rows(db))
+        db.close()
+        results.record(f"index_load/{size}", time.perf_counter() - start, rows=size)
+
+        start = time.perf_counter()
+        db = session()
+        pulse_fastapi.triage_metrics = TriageMetrics(stored_rows(db))
+        db.close()
+        results.record(f"metrics_load/{size}", time.perf_counter() - start, rows=size)
+
+        def insert_one():
+            db = session()
+            rows = new_rows(1)
+            before_insert(db, rows)
+            db.add_all(rows)
+            db.commit()
+            db.close()
+
+        def insert_bulk():
+            db = session()
+            rows = new_rows(1000)
+            before_insert(db, rows)
+            db.add_all(rows)
+            db.commit()
+            db.close()
+
+        def insert_batch_writer():
+            pulse_fastapi.writer.insert(new_rows(1000)).result()
+
+        results.measure(f"insert/single/{size}", insert_one, rows=size)
+        results.measure(f"insert/bulk_1000/{size}", insert_bulk, number=1, rows=size)
+        results.measure(f"insert/batch_writer_1000/{size}", insert_batch_writer, number=1, rows=size)
+
+        middle = size // 2
+        user = "0"
+        results.measure(f"get_prompts/newest_page/{size}", lambda: client.get("/prompts", params={"limit": 100}), rows=size)
+        results.measure(
+            f"get_prompts/middle_page/{size}",
+            lambda: client.get("/prompts", params={"limit": 100, "after": middle}), rows=size
+        )
+        results.measure(
+            f"get_prompts/user_page/{size}",
+            lambda: client.get(f"/prompts/users/{user}", params={"limit": 100}), rows=size
+        )
+        results.measure(f"get_prompt/{size}", lambda: client.get(f"/prompts/{middle}"), rows=size)
+        results.measure(f"get_prompt_stats/{size}", lambda: client.get("/prompts/stats"), rows=size)
+        results.measure(
+            f"get_prompt_stats/user/{size}", lambda: client.get("/prompts/stats", params={"u_id": user}), rows=size
+        )
+        results.measure(
+            f"get_prompt_rollups/hour/{size}", lambda: client.get("/prompts/rollups", params={"resolution": "hour"}), rows=size
+        )